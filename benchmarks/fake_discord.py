@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any
+
+import discord
+
+
+@dataclass
+class FakeUser:
+    id: int
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+
+@dataclass
+class FakeResponse:
+    interaction: FakeInteraction
+
+    async def send_message(self, content: str | None = None, **kwargs: Any) -> None:
+        self.interaction.messages.append({"content": content, **kwargs})
+
+
+@dataclass
+class FakeInteraction:
+    """Just enough of discord.Interaction for the generation commands,
+    recording every edit made to the original response."""
+
+    client: Any
+    user: FakeUser
+    application_id: int = 0
+    type: discord.InteractionType = discord.InteractionType.application_command
+    token: str = field(default_factory=lambda: uuid.uuid4().hex)
+    edit_latency: float = 0.05
+    messages: list[dict[str, Any]] = field(default_factory=list)
+    edits: list[tuple[float, dict[str, Any]]] = field(default_factory=list)
+    edit_durations: list[float] = field(default_factory=list)
+    response: FakeResponse = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.response = FakeResponse(self)
+
+    @property
+    def succeeded(self) -> bool:
+        return any(
+            "content" in kwargs
+            and kwargs["content"] is None
+            and (kwargs.get("embed") or kwargs.get("embeds"))
+            for _, kwargs in self.edits
+        )
+
+    async def edit_original_response(self, **kwargs: Any) -> None:
+        start = time.monotonic()
+        await asyncio.sleep(self.edit_latency)
+        self.edits.append((time.monotonic(), kwargs))
+        self.edit_durations.append(time.monotonic() - start)
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any
+
+from aiohttp import web
+
+
+@dataclass
+class FakeJob:
+    created_at: float
+    queue_delay: float
+    run_time: float
+    logs: list[dict[str, Any]] = field(default_factory=list)
+
+    def status(self, now: float) -> str:
+        if now < self.created_at + self.queue_delay:
+            return "IN_QUEUE"
+        elif now < self.created_at + self.queue_delay + self.run_time:
+            return "IN_PROGRESS"
+        else:
+            return "COMPLETED"
+
+
+@dataclass
+class FakeQueueServer:
+    """A local stand-in for a fal gateway's queue endpoints."""
+
+    queue_delay: float = 2.0
+    run_time: float = 5.0
+    jitter: float = 0.5
+    log_lines_per_second: float = 4.0
+    error_rate: float = 0.0
+    submit_delay: float = 0.0
+    # Serve status event streams, optionally cutting them off after a while
+    # to exercise the fallback to polling.
+    streaming: bool = True
+    stream_interval: float = 0.1
+    drop_streams_after: float | None = None
+    image_size: int = 256 * 1024
+    host: str = "127.0.0.1"
+    port: int = 0
+    requests: Counter[str] = field(default_factory=Counter, init=False)
+    injected_errors: int = field(default=0, init=False)
+    jobs: dict[str, FakeJob] = field(default_factory=dict, init=False)
+    _runner: web.AppRunner | None = field(default=None, init=False, repr=False)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/fal/queue/submit/", self.submit)
+        app.router.add_get("/fal/queue/requests/{request_id}/status", self.status)
+        if self.streaming:
+            app.router.add_get(
+                "/fal/queue/requests/{request_id}/status/stream", self.stream
+            )
+        app.router.add_get("/fal/queue/requests/{request_id}/response/", self.response)
+        app.router.add_put("/fal/queue/requests/{request_id}/cancel", self.cancel)
+        app.router.add_get("/images/{name}", self.image)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]  # type: ignore
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _maybe_fail(self) -> None:
+        if random.random() < self.error_rate:
+            self.injected_errors += 1
+            raise web.HTTPInternalServerError(
+                text='{"detail": "Injected failure"}',
+                content_type="application/json",
+            )
+
+    def _job(self, request: web.Request) -> FakeJob:
+        try:
+            return self.jobs[request.match_info["request_id"]]
+        except KeyError:
+            raise web.HTTPNotFound()
+
+    def _spread(self, value: float) -> float:
+        return max(value * random.uniform(1 - self.jitter, 1 + self.jitter), 0.0)
+
+    async def submit(self, request: web.Request) -> web.Response:
+        self.requests["submit"] += 1
+        await request.json()
+        await asyncio.sleep(self._spread(self.submit_delay))
+        self._maybe_fail()
+
+        request_id = str(uuid.uuid4())
+        self.jobs[request_id] = FakeJob(
+            created_at=time.monotonic(),
+            queue_delay=self._spread(self.queue_delay),
+            run_time=self._spread(self.run_time),
+        )
+        return web.json_response({"request_id": request_id})
+
+    def _status(self, job: FakeJob) -> dict[str, Any]:
+        now = time.monotonic()
+        match job.status(now):
+            case "IN_QUEUE":
+                position = sum(
+                    other.status(now) == "IN_QUEUE"
+                    and other.created_at < job.created_at
+                    for other in self.jobs.values()
+                )
+                return {"status": "IN_QUEUE", "queue_position": position}
+            case "IN_PROGRESS":
+                running_for = now - job.created_at - job.queue_delay
+                while len(job.logs) < int(running_for * self.log_lines_per_second):
+                    job.logs.append(
+                        {
+                            "timestamp": f"{time.time():.6f}-{len(job.logs)}",
+                            "message": f"Step {len(job.logs)}",
+                        }
+                    )
+                return {"status": "IN_PROGRESS", "logs": job.logs}
+            case _:
+                return {"status": "COMPLETED"}
+
+    async def status(self, request: web.Request) -> web.Response:
+        self.requests["status"] += 1
+        job = self._job(request)
+        self._maybe_fail()
+
+        # Mimic a gateway that ignores the cursor and always sends the full
+        # log history; clients are expected to diff locally.
+        status = self._status(job)
+        return web.json_response(
+            status, status=200 if status["status"] == "COMPLETED" else 202
+        )
+
+    async def stream(self, request: web.Request) -> web.StreamResponse:
+        self.requests["stream"] += 1
+        job = self._job(request)
+        self._maybe_fail()
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        started_at, sent_logs, last = time.monotonic(), 0, None
+        while True:
+            if (
+                self.drop_streams_after is not None
+                and time.monotonic() - started_at > self.drop_streams_after
+            ):
+                # Cut the connection without finishing the response.
+                request.transport.close()  # type: ignore[union-attr]
+                return response
+
+            status = self._status(job)
+            if status["status"] == "IN_PROGRESS":
+                # Streams only carry the log entries that are new.
+                status = {**status, "logs": job.logs[sent_logs:]}
+                sent_logs = len(job.logs)
+
+            if status != last or status.get("logs"):
+                await response.write(f"data: {json.dumps(status)}\n\n".encode())
+                last = status
+            if status["status"] == "COMPLETED":
+                await response.write_eof()
+                return response
+            await asyncio.sleep(self.stream_interval)
+
+    async def cancel(self, request: web.Request) -> web.Response:
+        self.requests["cancel"] += 1
+        job = self._job(request)
+        if job.status(time.monotonic()) == "COMPLETED":
+            return web.json_response({"status": "ALREADY_COMPLETED"}, status=400)
+
+        del self.jobs[request.match_info["request_id"]]
+        return web.json_response({"status": "CANCELLATION_REQUESTED"}, status=202)
+
+    async def response(self, request: web.Request) -> web.Response:
+        self.requests["response"] += 1
+        self._job(request)
+        self._maybe_fail()
+
+        image_url = f"{self.url}/images/{request.match_info['request_id']}.png"
+        return web.json_response({"images": [{"url": image_url}]})
+
+    async def image(self, request: web.Request) -> web.Response:
+        self.requests["image"] += 1
+        return web.Response(body=os.urandom(self.image_size), content_type="image/png")
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import os
+import time
+from argparse import ArgumentParser, Namespace
+from typing import Any
+
+# The bot's configuration is read from the environment at import time.
+os.environ.setdefault("DISCORD_TOKEN", "benchmark")
+os.environ.setdefault("FAL_SECRET", "benchmark")
+os.environ.setdefault("GUILD_ID", "0")
+
+from benchmarks.fake_discord import FakeInteraction, FakeUser  # noqa: E402
+from benchmarks.fake_queue import FakeQueueServer  # noqa: E402
+from fal_bot import registry  # noqa: E402
+from fal_bot.bot import FalBot  # noqa: E402
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    if not samples:
+        return math.nan
+
+    ordered = sorted(samples)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    return {
+        "p50": percentile(samples, 0.50),
+        "p90": percentile(samples, 0.90),
+        "p99": percentile(samples, 0.99),
+        "max": max(samples, default=math.nan),
+    }
+
+
+async def monitor_loop_lag(samples: list[float], interval: float = 0.05) -> None:
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        samples.append(time.monotonic() - start - interval)
+
+
+async def run_job(
+    bot: FalBot,
+    job_id: int,
+    options: Namespace,
+) -> FakeInteraction:
+    interaction = FakeInteraction(
+        bot,
+        FakeUser(job_id % options.users),
+        edit_latency=options.edit_latency,
+    )
+    prompt = "a benchmark prompt"
+    if not options.repeat_prompts:
+        prompt += f" #{job_id}"
+
+    command = options.command
+    if command == "mixed":
+        command = "fooocus" if job_id % 2 == 0 else "diffusion"
+
+    callback = registry.ENDPOINTS[command].command.callback
+    await callback(interaction, prompt=prompt, count=options.count)  # type: ignore
+    return interaction
+
+
+async def run(options: Namespace) -> dict[str, Any]:
+    server = FakeQueueServer(
+        queue_delay=options.queue_delay,
+        run_time=options.run_time,
+        log_lines_per_second=options.log_rate,
+        error_rate=options.error_rate,
+        streaming=not options.no_streaming,
+    )
+    await server.start()
+    for endpoint in registry.ENDPOINTS.values():
+        endpoint.url = server.url
+        endpoint.rehost_images = options.rehost_images
+        endpoint.dedupe = endpoint.cache = options.repeat_prompts
+
+    bot = FalBot()
+    await bot.start_services()
+
+    lag_samples: list[float] = []
+    lag_monitor = asyncio.create_task(monitor_loop_lag(lag_samples))
+
+    latencies: list[float] = []
+    interactions: list[FakeInteraction] = []
+    semaphore = asyncio.Semaphore(options.concurrency)
+
+    async def worker(job_id: int) -> None:
+        async with semaphore:
+            start = time.monotonic()
+            interaction = await run_job(bot, job_id, options)
+            interactions.append(interaction)
+            if interaction.succeeded:
+                latencies.append(time.monotonic() - start)
+
+    started_at = time.monotonic()
+    try:
+        await asyncio.gather(*(worker(job_id) for job_id in range(options.jobs)))
+    finally:
+        wall_time = time.monotonic() - started_at
+        lag_monitor.cancel()
+        await bot.stop_services()
+        await server.stop()
+
+    completed = len(latencies)
+    edit_durations = [
+        duration
+        for interaction in interactions
+        for duration in interaction.edit_durations
+    ]
+    return {
+        "command": options.command,
+        "jobs": options.jobs,
+        "concurrency": options.concurrency,
+        "completed": completed,
+        "failed": options.jobs - completed,
+        "wall_time": wall_time,
+        "latency": summarize(latencies),
+        "http_requests": dict(server.requests),
+        "injected_errors": server.injected_errors,
+        "http_requests_per_job": sum(server.requests.values()) / max(completed, 1),
+        "status_polls_per_job": server.requests["status"] / max(completed, 1),
+        "status_streams_per_job": server.requests["stream"] / max(completed, 1),
+        "image_downloads_per_job": server.requests["image"] / max(completed, 1),
+        "discord_edits_per_job": len(edit_durations) / max(completed, 1),
+        "event_loop_lag": summarize(lag_samples),
+    }
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Benchmark the bot against a fake fal queue.")
+    parser.add_argument(
+        "--command",
+        choices=["fooocus", "diffusion", "mixed"],
+        default="fooocus",
+    )
+    parser.add_argument("--jobs", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--count", type=int, default=1, help="Images per job")
+    parser.add_argument("--queue-delay", type=float, default=2.0)
+    parser.add_argument("--run-time", type=float, default=5.0)
+    parser.add_argument("--log-rate", type=float, default=4.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--edit-latency", type=float, default=0.05)
+    parser.add_argument(
+        "--no-streaming",
+        help="Do not offer status streams (exercises the polling fallback)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--rehost-images",
+        help="Upload result images as attachments instead of hotlinking them",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--repeat-prompts",
+        help="Use the same prompt for every job (exercises dedupe and caching)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="Append the report as a JSON line to this file",
+    )
+
+    options = parser.parse_args()
+    report = asyncio.run(run(options))
+
+    print(json.dumps(report, indent=4))
+    if options.output:
+        with open(options.output, "a") as stream:
+            stream.write(json.dumps(report) + "\n")
+
+
+if __name__ == "__main__":
+    main()
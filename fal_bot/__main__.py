@@ -1,8 +1,10 @@
 import asyncio
+import sys
 from argparse import ArgumentParser
 
 from fal_bot import config
 from fal_bot.bot import client
+from fal_bot.launcher import run_processes
 
 
 def main():
@@ -18,9 +20,33 @@ def main():
         help="Only sync slash commands",
         action="store_true",
     )
+    parser.add_argument(
+        "--force-sync",
+        help="Sync slash commands even if they did not change",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Split the shards across this many processes",
+    )
 
     options = parser.parse_args()
-    if options.sync_only:
+    client.force_sync = options.force_sync
+    if options.processes > 1:
+        try:
+            code = asyncio.run(
+                run_processes(
+                    options.processes,
+                    options.token,
+                    force_sync=options.force_sync,
+                )
+            )
+        except ValueError as exc:
+            parser.error(str(exc))
+        sys.exit(code)
+    elif options.sync_only:
         asyncio.run(client.sync_commands(options.token))
     else:
         client.run(options.token)
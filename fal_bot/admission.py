@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable
+
+from fal_bot import config, metrics
+
+if TYPE_CHECKING:
+    from fal_bot.coordinator import Coordinator
+
+# Priority lanes, from most to least latency sensitive.
+INTERACTIVE = "interactive"
+REGENERATE = "regenerate"
+BATCH = "batch"
+LANES = (INTERACTIVE, REGENERATE, BATCH)
+
+
+@dataclass
+class _Ticket:
+    endpoint: str
+    user_id: int
+    lane: str
+    queued_at: float = field(default_factory=time.monotonic)
+    admitted: asyncio.Future[None] = field(
+        default_factory=lambda: asyncio.get_running_loop().create_future()
+    )
+
+
+@dataclass
+class _Lane:
+    weight: int
+    # Smooth weighted round-robin state, see AdmissionController._pick.
+    credit: int = 0
+    # Waiting tickets grouped per user; users are served round-robin in
+    # the order of this mapping and moved to the back once served.
+    waiting: OrderedDict[int, deque[_Ticket]] = field(default_factory=OrderedDict)
+
+    def __len__(self) -> int:
+        return sum(map(len, self.waiting.values()))
+
+    def position(self, ticket: _Ticket) -> int:
+        # Replays the round-robin order: every user gets one slot per round
+        # and within a round users are served in mapping order.
+        rank = self.waiting[ticket.user_id].index(ticket)
+
+        position, ahead = 1, True
+        for user_id, tickets in self.waiting.items():
+            if user_id == ticket.user_id:
+                ahead = False
+            position += min(len(tickets), rank)
+            if ahead and len(tickets) > rank:
+                position += 1
+        return position
+
+
+@dataclass
+class _Endpoint:
+    lanes: dict[str, _Lane]
+    running: int = 0
+
+    def position(self, ticket: _Ticket) -> int:
+        # An estimate: everything in heavier lanes is counted as going first.
+        lane = self.lanes[ticket.lane]
+        return lane.position(ticket) + sum(
+            len(other) for other in self.lanes.values() if other.weight > lane.weight
+        )
+
+
+@dataclass
+class AdmissionController:
+    """Caps how many generation jobs run at once, both per endpoint and
+    per user, and admits the overflow fairly across users.
+
+    Waiting jobs are split into priority lanes which share the free slots
+    in proportion to their weights, so a fresh command does not queue
+    behind re-rolls and batches. A job that has waited longer than
+    `max_wait` is admitted first regardless of its lane.
+
+    With a `coordinator`, admitted jobs additionally wait for a slot under
+    the limits shared with the other bot processes."""
+
+    max_in_flight: int = config.ADMISSION_MAX_IN_FLIGHT
+    max_per_user: int = config.ADMISSION_MAX_PER_USER
+    weights: dict[str, int] = field(
+        default_factory=lambda: dict(config.ADMISSION_LANE_WEIGHTS)
+    )
+    max_wait: float = config.ADMISSION_MAX_WAIT
+    coordinator: Coordinator | None = None
+    _endpoints: dict[str, _Endpoint] = field(default_factory=dict, init=False)
+    _running_per_user: Counter[int] = field(default_factory=Counter, init=False)
+    _changed: asyncio.Event = field(default_factory=asyncio.Event, init=False)
+
+    def in_flight(self, endpoint: str) -> int:
+        return self._endpoints[endpoint].running if endpoint in self._endpoints else 0
+
+    def waiting(self, endpoint: str, lane: str | None = None) -> int:
+        if endpoint not in self._endpoints:
+            return 0
+
+        lanes = self._endpoints[endpoint].lanes
+        if lane is not None:
+            return len(lanes[lane])
+        return sum(map(len, lanes.values()))
+
+    @asynccontextmanager
+    async def admit(
+        self,
+        endpoint: str,
+        user_id: int,
+        *,
+        lane: str = INTERACTIVE,
+        on_wait: Callable[[int], None] | None = None,
+    ) -> AsyncIterator[None]:
+        if lane not in LANES:
+            raise ValueError(f"Unknown admission lane: {lane!r}")
+
+        ticket = _Ticket(endpoint, user_id, lane)
+        queue = self._endpoints.get(endpoint)
+        if queue is None:
+            queue = self._endpoints[endpoint] = _Endpoint(
+                {name: _Lane(max(self.weights.get(name, 1), 1)) for name in LANES}
+            )
+        queue.lanes[lane].waiting.setdefault(user_id, deque()).append(ticket)
+        self._dispatch()
+
+        lease = None
+        try:
+            while not ticket.admitted.done():
+                if on_wait is not None:
+                    on_wait(queue.position(ticket))
+
+                changed: asyncio.Future[Any] = asyncio.ensure_future(
+                    self._changed.wait()
+                )
+                try:
+                    await asyncio.wait(
+                        {ticket.admitted, changed},
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                finally:
+                    changed.cancel()
+
+            if self.coordinator is not None:
+                lease = await self.coordinator.acquire(endpoint, user_id)
+        except BaseException:
+            if ticket.admitted.done():
+                self._release(queue, user_id)
+            else:
+                self._withdraw(queue, ticket)
+            raise
+
+        metrics.ADMISSION_WAIT.labels(endpoint=endpoint, lane=lane).observe(
+            time.monotonic() - ticket.queued_at
+        )
+        try:
+            yield
+        finally:
+            self._release(queue, user_id)
+            if lease is not None:
+                await self.coordinator.release(lease)  # type: ignore[union-attr]
+
+    def _release(self, queue: _Endpoint, user_id: int) -> None:
+        queue.running -= 1
+        self._running_per_user[user_id] -= 1
+        if not self._running_per_user[user_id]:
+            del self._running_per_user[user_id]
+        self._dispatch()
+
+    def _withdraw(self, queue: _Endpoint, ticket: _Ticket) -> None:
+        waiting = queue.lanes[ticket.lane].waiting
+        tickets = waiting[ticket.user_id]
+        tickets.remove(ticket)
+        if not tickets:
+            del waiting[ticket.user_id]
+        ticket.admitted.cancel()
+        self._notify()
+
+    def _next_user(self, lane: _Lane) -> int | None:
+        for user_id in lane.waiting:
+            if self._running_per_user[user_id] < self.max_per_user:
+                return user_id
+        return None
+
+    def _pick(self, queue: _Endpoint) -> tuple[_Lane, int] | None:
+        candidates = []
+        for lane in queue.lanes.values():
+            if (user_id := self._next_user(lane)) is not None:
+                candidates.append((lane, user_id))
+        if not candidates:
+            return None
+
+        # Starvation protection: an overdue ticket goes first, oldest first.
+        now = time.monotonic()
+        overdue = [
+            (lane.waiting[user_id][0].queued_at, lane, user_id)
+            for lane, user_id in candidates
+            if now - lane.waiting[user_id][0].queued_at >= self.max_wait
+        ]
+        if overdue:
+            _, lane, user_id = min(overdue, key=lambda item: item[0])
+            return lane, user_id
+
+        # Smooth weighted round-robin (as in nginx) between the lanes that
+        # have someone to admit: interleaves lanes instead of bursting.
+        total = 0
+        for lane, _ in candidates:
+            lane.credit += lane.weight
+            total += lane.weight
+
+        lane, user_id = max(candidates, key=lambda item: item[0].credit)
+        lane.credit -= total
+        return lane, user_id
+
+    def _dispatch(self) -> None:
+        for queue in self._endpoints.values():
+            while queue.running < self.max_in_flight:
+                if (picked := self._pick(queue)) is None:
+                    break
+
+                lane, user_id = picked
+                tickets = lane.waiting[user_id]
+                ticket = tickets.popleft()
+                if tickets:
+                    lane.waiting.move_to_end(user_id)
+                else:
+                    del lane.waiting[user_id]
+
+                queue.running += 1
+                self._running_per_user[user_id] += 1
+                ticket.admitted.set_result(None)
+
+        self._notify()
+
+    def _notify(self) -> None:
+        for endpoint, queue in self._endpoints.items():
+            metrics.ADMISSION_IN_FLIGHT.labels(endpoint=endpoint).set(queue.running)
+            for name, lane in queue.lanes.items():
+                metrics.ADMISSION_WAITING.labels(endpoint=endpoint, lane=name).set(
+                    len(lane)
+                )
+
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
@@ -1,39 +1,280 @@
-import importlib
+import asyncio
+import logging
+import signal
+import time
+from typing import Any, Coroutine
 
 import discord
+from aiohttp import web
 from discord import app_commands
 
-from fal_bot.config import RAW_GUILD_ID
+from fal_bot import config, metrics, registry, utils
+from fal_bot.admission import AdmissionController
+from fal_bot.cache import ResultCache, make_result_cache
+from fal_bot.command_sync import make_command_sync_cache
+from fal_bot.coordinator import make_coordinator
+from fal_bot.delivery import ImageDelivery
+from fal_bot.editor import InteractionGone, MessageEditor, WebhookResponse
+from fal_bot.journal import Journal, JournalEntry, make_journal
+from fal_bot.lora_cache import LoraCache
+from fal_bot.queue_client import (
+    ClientPool,
+    RequestHandle,
+    SingleFlight,
+    StatusPoller,
+    queue_client,
+)
+from fal_bot.view_state import ViewStateStore
 
-MODULES = [
-    "fal_bot.fooocus",
-    "fal_bot.lora",
-]
+logger = logging.getLogger(__name__)
 
 
-class FalBot(discord.Client):
+class FalCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # Also runs for autocomplete requests, which must not be gated.
+        command = interaction.command
+        if (
+            interaction.type is not discord.InteractionType.application_command
+            or command is None
+            or not command.extras.get("generation")
+        ):
+            return True
+        return await utils.accept_generation(interaction)
+
+
+class FalBot(discord.AutoShardedClient):
     def __init__(self):
         intents = discord.Intents.default()
-        super().__init__(intents=intents)
+        super().__init__(
+            intents=intents,
+            shard_count=config.SHARD_COUNT,
+            shard_ids=config.SHARD_IDS,
+        )
+
+        self.tree = FalCommandTree(self)
+        self.draining = False
+        self.active_tasks: set[asyncio.Task[Any]] = set()
+        self._drain_task: asyncio.Task[None] | None = None
+        self.http_clients: ClientPool | None = None
+        self.status_poller: StatusPoller | None = None
+        self.single_flight = SingleFlight()
+        self.result_cache: ResultCache | None = None
+        self.admission = AdmissionController()
+        self.metrics_server: web.AppRunner | None = None
+        self._loop_lag_monitor: asyncio.Task[None] | None = None
+        self.journal: Journal | None = None
+        self.view_states = ViewStateStore()
+        self.command_sync = make_command_sync_cache()
+        self.force_sync = False
+        # Set for `--sync-only` runs, which log in just to sync the commands
+        # and must leave the journal and the metrics port to the live bot.
+        self.sync_only = False
+        self.lora_cache = LoraCache()
+        self.image_delivery = ImageDelivery()
+
+    async def start_services(self) -> None:
+        self.http_clients = ClientPool()
+        self.status_poller = poller = StatusPoller()
+        poller.start()
+        self.result_cache = cache = make_result_cache()
+        self.journal = make_journal()
+        if self.journal is not None:
+            self.journal.start()
+        self.admission.coordinator = make_coordinator()
+        self._loop_lag_monitor = asyncio.create_task(metrics.monitor_event_loop_lag())
+        self._export_service_metrics(poller, cache)
 
-        self.tree = app_commands.CommandTree(self)
+    def _export_service_metrics(self, poller: StatusPoller, cache: ResultCache) -> None:
+        metrics.STATUS_POLLER_WATCHES.labels().set_function(lambda: poller.in_flight)
+        metrics.RESULT_CACHE_LOOKUPS.labels(outcome="hit").set_function(
+            lambda: cache.hits
+        )
+        metrics.RESULT_CACHE_LOOKUPS.labels(outcome="miss").set_function(
+            lambda: cache.misses
+        )
 
-    async def load_module(self, module_name: str) -> None:
-        module = importlib.import_module(module_name)
-        self.tree.add_command(module.command)  # type: ignore
+    async def stop_services(self) -> None:
+        if self.admission.coordinator is not None:
+            await self.admission.coordinator.aclose()
+            self.admission.coordinator = None
+        if self._loop_lag_monitor is not None:
+            self._loop_lag_monitor.cancel()
+            self._loop_lag_monitor = None
+        if self.journal is not None:
+            await self.journal.aclose()
+            self.journal = None
+        if self.status_poller is not None:
+            await self.status_poller.aclose()
+            self.status_poller = None
+        if self.http_clients is not None:
+            await self.http_clients.aclose()
+            self.http_clients = None
+        if self.result_cache is not None:
+            await self.result_cache.aclose()
+            self.result_cache = None
+        await self.lora_cache.aclose()
+        await self.image_delivery.aclose()
 
     async def setup_hook(self):
-        for module in MODULES:
-            await self.load_module(module)
+        for endpoint in registry.ENDPOINTS.values():
+            self.tree.add_command(endpoint.command)
+        if self.sync_only:
+            return
+
+        # Fly stops machines with SIGINT unless told otherwise, so both
+        # signals drain.
+        try:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                asyncio.get_running_loop().add_signal_handler(
+                    signum, self._on_stop_signal
+                )
+        except NotImplementedError:
+            pass
+
+        await self.start_services()
+        if config.METRICS_PORT:
+            self.metrics_server = await metrics.start_metrics_server()
+
+        if self.journal is not None:
+            for entry in await self.journal.replay():
+                self.spawn(
+                    self.resume_request(entry),
+                    name=f"resumed {entry.command} {entry.request_id}",
+                )
+
+        if config.SYNC_COMMANDS:
+            await self.sync_guild_commands()
+
+    async def close(self) -> None:
+        try:
+            await super().close()
+        finally:
+            await self.stop_services()
+            if self.metrics_server is not None:
+                await self.metrics_server.cleanup()
+                self.metrics_server = None
+
+    async def on_interaction(self, interaction: discord.Interaction) -> None:
+        # Components of result messages are persistent: they are routed by
+        # the endpoint name prefixing their custom_id rather than by a View.
+        if interaction.type is not discord.InteractionType.component:
+            return
+
+        name, _, custom_id = (
+            (interaction.data or {}).get("custom_id", "").partition(":")
+        )
+        endpoint = registry.ENDPOINTS.get(name)
+        if endpoint is not None and custom_id:
+            await endpoint.handle_component(interaction, custom_id)
+
+    def track(self, task: asyncio.Task[Any]) -> None:
+        self.active_tasks.add(task)
+        task.add_done_callback(self.active_tasks.discard)
+
+    def spawn(
+        self,
+        coroutine: Coroutine[Any, Any, None],
+        *,
+        name: str | None = None,
+    ) -> asyncio.Task[None]:
+        task = asyncio.create_task(coroutine, name=name)
+        self.track(task)
+        return task
+
+    def _on_stop_signal(self) -> None:
+        if self._drain_task is None:
+            self._drain_task = asyncio.create_task(self.drain())
+
+    async def drain(self, timeout: float = config.DRAIN_TIMEOUT) -> None:
+        # Stop taking new generation requests, give the ones in flight a
+        # chance to finish, then shut down.
+        self.draining = True
+        pending = set(self.active_tasks)
+        logger.info("Draining %d in-flight requests", len(pending))
+
+        if pending:
+            _, unfinished = await asyncio.wait(pending, timeout=timeout)
+            if unfinished:
+                logger.warning(
+                    "Shutting down with %d unfinished requests: %s",
+                    len(unfinished),
+                    ", ".join(sorted(task.get_name() for task in unfinished)),
+                )
+                # Cancelling still lets them flush their pending edits.
+                for task in unfinished:
+                    task.cancel()
+                await asyncio.wait(unfinished, timeout=5)
+
+        await self.close()
+
+    async def resume_request(self, entry: JournalEntry) -> None:
+        journal = self.journal
+        assert journal is not None
+
+        endpoint = registry.ENDPOINTS.get(entry.command)
+        if endpoint is None:
+            journal.finished(entry.token)
+            return
+
+        logger.info("Resuming request %s (%s)", entry.request_id, entry.command)
+        response = WebhookResponse(
+            discord.Webhook.partial(entry.application_id, entry.token, client=self),
+            client=self,
+        )
+        try:
+            async with queue_client(
+                entry.url,
+                pool=self.http_clients,
+                on_error=utils.on_error(response),  # type: ignore[arg-type]
+            ) as client:
+                request_handle = RequestHandle(entry.request_id)
+                editor = MessageEditor(response)
+                try:
+                    statuses = utils.watch_status(self, client, request_handle)
+                    await utils.report_progress(editor, statuses, request_handle)
+                except InteractionGone:
+                    await utils.abandon(client, request_handle)
+                    journal.finished(entry.token)
+                    return
+                finally:
+                    await editor.flush()
+
+                result = await client.result(request_handle)
+                await endpoint.deliver(
+                    response,
+                    [result],
+                    options=entry.options,
+                    user_mention=entry.user_mention,
+                    elapsed=time.time() - entry.submitted_at,
+                    view=endpoint.make_view(
+                        self,
+                        entry.application_id,
+                        entry.token,
+                        entry.options,
+                        issued_at=entry.submitted_at,
+                    ),
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Failed to resume request %s", entry.request_id)
+
+        journal.finished(entry.token)
+
+    async def sync_guild_commands(self) -> None:
+        if not config.GUILD_IDS:
+            await self.command_sync.sync(self.tree, force=self.force_sync)
 
-        guild = discord.Object(id=int(RAW_GUILD_ID))
-        self.tree.copy_global_to(guild=guild)
-        await self.tree.sync(guild=guild)
+        for guild_id in config.GUILD_IDS:
+            guild = discord.Object(id=guild_id)
+            self.tree.copy_global_to(guild=guild)
+            await self.command_sync.sync(self.tree, guild=guild, force=self.force_sync)
 
     async def sync_commands(self, token: str) -> None:
+        self.sync_only = True
         await self.login(token)
         try:
-            await self.tree.sync()
+            await self.sync_guild_commands()
         finally:
             await self.close()
 
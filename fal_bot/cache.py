@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Protocol
+
+from fal_bot import config
+
+
+class ResultCache(Protocol):
+    hits: int
+    misses: int
+
+    async def get(self, key: str) -> dict[str, Any] | None:
+        ...
+
+    async def set(self, key: str, value: dict[str, Any]) -> None:
+        ...
+
+    async def aclose(self) -> None:
+        ...
+
+
+@dataclass
+class MemoryResultCache:
+    max_entries: int = config.RESULT_CACHE_SIZE
+    ttl: float = config.RESULT_CACHE_TTL
+    hits: int = field(default=0, init=False)
+    misses: int = field(default=0, init=False)
+    _entries: OrderedDict[str, tuple[float, dict[str, Any]]] = field(
+        default_factory=OrderedDict, init=False, repr=False
+    )
+
+    async def get(self, key: str) -> dict[str, Any] | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    async def set(self, key: str, value: dict[str, Any]) -> None:
+        self._entries[key] = (time.time() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def aclose(self) -> None:
+        self._entries.clear()
+
+
+@dataclass
+class SQLiteResultCache:
+    path: str
+    max_entries: int = config.RESULT_CACHE_SIZE
+    ttl: float = config.RESULT_CACHE_TTL
+    hits: int = field(default=0, init=False)
+    misses: int = field(default=0, init=False)
+    _connection: sqlite3.Connection = field(init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False)
+
+    def __post_init__(self) -> None:
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, "
+                "value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, "
+                "accessed_at REAL NOT NULL)"
+            )
+
+    def _get(self, key: str) -> dict[str, Any] | None:
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT value FROM results WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+            if row is not None:
+                self._connection.execute(
+                    "UPDATE results SET accessed_at = ? WHERE key = ?", (now, key)
+                )
+        return None if row is None else json.loads(row[0])
+
+    def _set(self, key: str, value: dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + self.ttl, now),
+            )
+            self._connection.execute(
+                "DELETE FROM results WHERE expires_at <= ?", (now,)
+            )
+            self._connection.execute(
+                "DELETE FROM results WHERE key NOT IN "
+                "(SELECT key FROM results ORDER BY accessed_at DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    async def get(self, key: str) -> dict[str, Any] | None:
+        value = await asyncio.to_thread(self._get, key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: dict[str, Any]) -> None:
+        await asyncio.to_thread(self._set, key, value)
+
+    async def aclose(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+def make_result_cache() -> ResultCache:
+    if config.RESULT_CACHE_PATH:
+        return SQLiteResultCache(config.RESULT_CACHE_PATH)
+    return MemoryResultCache()
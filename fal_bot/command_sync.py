@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass
+
+import discord
+from discord import app_commands
+
+from fal_bot import config
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(
+    tree: app_commands.CommandTree,
+    guild: discord.abc.Snowflake | None = None,
+) -> str:
+    payload = [command.to_dict() for command in tree.get_commands(guild=guild)]
+    payload.sort(key=lambda command: (command["type"], command["name"]))
+    serialized = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+@dataclass
+class CommandSyncCache:
+    """Remembers the fingerprint of the last command tree synced to each
+    scope, so that restarts skip the (slow and rate limited) sync call
+    when nothing changed."""
+
+    path: str
+
+    def _load(self) -> dict[str, str]:
+        try:
+            with open(self.path) as stream:
+                return json.load(stream)
+        except (OSError, ValueError):
+            return {}
+
+    def _store(self, fingerprints: dict[str, str]) -> None:
+        try:
+            with open(self.path + ".tmp", "w") as stream:
+                json.dump(fingerprints, stream, indent=4, sort_keys=True)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError:
+            logger.warning("Could not persist command fingerprints to %s", self.path)
+
+    async def sync(
+        self,
+        tree: app_commands.CommandTree,
+        *,
+        guild: discord.abc.Snowflake | None = None,
+        force: bool = False,
+    ) -> bool:
+        scope = f"{tree.client.application_id}:{guild.id if guild else 'global'}"
+        current = fingerprint(tree, guild)
+
+        fingerprints = self._load()
+        if not force and fingerprints.get(scope) == current:
+            logger.info("Commands for %s are up to date, skipping sync", scope)
+            return False
+
+        await tree.sync(guild=guild)
+        fingerprints[scope] = current
+        self._store(fingerprints)
+        return True
+
+
+def make_command_sync_cache() -> CommandSyncCache:
+    return CommandSyncCache(config.COMMAND_SYNC_CACHE_PATH)
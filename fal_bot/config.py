@@ -1,7 +1,138 @@
+import json
 import os
 
 DISCORD_TOKEN = os.environ["DISCORD_TOKEN"]
 FAL_SECRET = os.environ["FAL_SECRET"]
-RAW_GUILD_ID = os.environ["GUILD_ID"]
+# Comma separated guilds to register the commands in; global when empty.
+RAW_GUILD_ID = os.environ.get("GUILD_ID", "")
+GUILD_IDS = [int(guild_id) for guild_id in RAW_GUILD_ID.split(",") if guild_id.strip()]
 
 FALAI_LOGO_URL = "https://avatars.githubusercontent.com/u/74778219?s=200&v=4"
+
+# Fingerprints of the last synced command trees, to skip redundant syncs.
+# Needs to live on a persistent volume for restarts after a deploy to skip
+# them too; the default is relative to the working directory.
+COMMAND_SYNC_CACHE_PATH = os.environ.get(
+    "FAL_COMMAND_SYNC_CACHE_PATH", ".fal_bot_commands.json"
+)
+
+# Overrides the gateway URL of generation commands, as a JSON object keyed
+# by command name.
+ENDPOINT_URLS: dict[str, str] = json.loads(os.environ.get("FAL_ENDPOINT_URLS", "{}"))
+
+# Connection pool settings for the long-lived gateway clients.
+HTTP_MAX_CONNECTIONS = int(os.environ.get("FAL_HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.environ.get("FAL_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)
+)
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("FAL_HTTP_KEEPALIVE_EXPIRY", 60))
+HTTP2_ENABLED = os.environ.get("FAL_HTTP2", "0") == "1"
+
+# Minimum number of seconds between two progress edits of the same message.
+DISCORD_EDIT_INTERVAL = float(os.environ.get("DISCORD_EDIT_INTERVAL", 1.0))
+
+# Global budget shared by every in-flight status poll.
+STATUS_POLL_CONCURRENCY = int(os.environ.get("FAL_STATUS_POLL_CONCURRENCY", 16))
+STATUS_POLL_RATE = float(os.environ.get("FAL_STATUS_POLL_RATE", 20))
+
+# Follow status event streams where endpoints offer them, falling back to
+# polling; a stream silent for longer than the timeout counts as broken.
+# Opening a stream takes from the poll budget above, and at most
+# STATUS_MAX_STREAMS are followed at once.
+STATUS_STREAMING = os.environ.get("FAL_STATUS_STREAMING", "1") == "1"
+STATUS_STREAM_TIMEOUT = float(os.environ.get("FAL_STATUS_STREAM_TIMEOUT", 30))
+STATUS_MAX_STREAMS = int(os.environ.get("FAL_STATUS_MAX_STREAMS", 100))
+
+# Completed results are cached in memory, or in SQLite when a path is given.
+RESULT_CACHE_PATH = os.environ.get("FAL_RESULT_CACHE_PATH")
+RESULT_CACHE_SIZE = int(os.environ.get("FAL_RESULT_CACHE_SIZE", 1024))
+RESULT_CACHE_TTL = float(os.environ.get("FAL_RESULT_CACHE_TTL", 60 * 60))
+
+# LoRA URLs are checked before their jobs are queued. Valid and rejected
+# URLs are remembered for the respective TTLs; a check that takes longer
+# than the timeout lets the job through.
+LORA_PREFLIGHT = os.environ.get("FAL_LORA_PREFLIGHT", "1") == "1"
+LORA_PREFLIGHT_TIMEOUT = float(os.environ.get("FAL_LORA_PREFLIGHT_TIMEOUT", 2.0))
+LORA_MAX_SIZE = int(os.environ.get("FAL_LORA_MAX_SIZE_MB", 2048)) * 2**20
+LORA_CACHE_SIZE = int(os.environ.get("FAL_LORA_CACHE_SIZE", 4096))
+LORA_CACHE_TTL = float(os.environ.get("FAL_LORA_CACHE_TTL", 6 * 60 * 60))
+LORA_NEGATIVE_TTL = float(os.environ.get("FAL_LORA_NEGATIVE_TTL", 10 * 60))
+LORA_RECENT_PER_GUILD = int(os.environ.get("FAL_LORA_RECENT_PER_GUILD", 25))
+
+# Commands (comma separated) whose result images are re-hosted as message
+# attachments instead of being hotlinked from fal's storage. Discord's own
+# attachment URLs expire as well, so uploads are only reused for a while.
+REHOST_COMMANDS = {
+    name.strip()
+    for name in os.environ.get("FAL_REHOST_IMAGES", "").split(",")
+    if name.strip()
+}
+REHOST_MAX_SIZE = int(os.environ.get("FAL_REHOST_MAX_SIZE_MB", 10)) * 2**20
+REHOST_MEMORY_LIMIT = int(os.environ.get("FAL_REHOST_MEMORY_LIMIT_MB", 4)) * 2**20
+REHOST_CONCURRENCY = int(os.environ.get("FAL_REHOST_CONCURRENCY", 8))
+REHOST_TIMEOUT = float(os.environ.get("FAL_REHOST_TIMEOUT", 15))
+REHOST_PREVIEW_FORMAT = os.environ.get("FAL_REHOST_PREVIEW_FORMAT") or None
+REHOST_PREVIEW_QUALITY = int(os.environ.get("FAL_REHOST_PREVIEW_QUALITY", 85))
+REHOST_CACHE_SIZE = int(os.environ.get("FAL_REHOST_CACHE_SIZE", 1024))
+REHOST_CACHE_TTL = float(os.environ.get("FAL_REHOST_CACHE_TTL", 12 * 60 * 60))
+
+# State kept for the components of result messages; buttons keep working
+# without it, but have to recover their state from the message.
+VIEW_STATE_SIZE = int(os.environ.get("FAL_VIEW_STATE_SIZE", 10_000))
+VIEW_STATE_TTL = float(os.environ.get("FAL_VIEW_STATE_TTL", 24 * 60 * 60))
+
+# Where the Prometheus /metrics endpoint listens; a port of 0 disables it.
+METRICS_HOST = os.environ.get("FAL_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("FAL_METRICS_PORT", 9091))
+
+# Append-only journal of submitted requests, resumed after a restart. Needs
+# to live on a persistent volume to survive deploys.
+JOURNAL_PATH = os.environ.get("FAL_JOURNAL_PATH")
+
+# How long in-flight requests may keep running after a SIGTERM or SIGINT.
+# Keep this below the deployment's kill timeout.
+DRAIN_TIMEOUT = float(os.environ.get("FAL_DRAIN_TIMEOUT", 20))
+
+# Admission control for generation jobs.
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("FAL_MAX_IN_FLIGHT_PER_ENDPOINT", 32))
+ADMISSION_MAX_PER_USER = int(os.environ.get("FAL_MAX_IN_FLIGHT_PER_USER", 2))
+
+# Relative share of admissions each priority lane gets while they compete,
+# and how long a waiting job may be passed over before it goes first.
+ADMISSION_LANE_WEIGHTS = {
+    lane: int(os.environ.get(f"FAL_ADMISSION_WEIGHT_{lane.upper()}", weight))
+    for lane, weight in {"interactive": 6, "regenerate": 3, "batch": 1}.items()
+}
+ADMISSION_MAX_WAIT = float(os.environ.get("FAL_ADMISSION_MAX_WAIT", 30))
+
+# Resilience of gateway calls: a gateway's circuit opens after this many
+# consecutive failures and is probed again after the reset timeout.
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("FAL_BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_TIMEOUT = float(os.environ.get("FAL_BREAKER_RESET_TIMEOUT", 30))
+RETRY_ATTEMPTS = int(os.environ.get("FAL_RETRY_ATTEMPTS", 3))
+RETRY_BASE_DELAY = float(os.environ.get("FAL_RETRY_BASE_DELAY", 0.25))
+# Only new requests fail fast. Jobs that were already submitted keep
+# backing off through failed calls and an open circuit for this long.
+OUTAGE_PATIENCE = float(os.environ.get("FAL_OUTAGE_PATIENCE", 5 * 60))
+
+# Maps a gateway URL to an alternate one (as a JSON object). Submits are
+# also sent to the alternate when the primary is down or slower than this.
+ALTERNATE_ENDPOINTS: dict[str, str] = json.loads(
+    os.environ.get("FAL_ALTERNATE_ENDPOINTS", "{}")
+)
+HEDGE_AFTER = float(os.environ.get("FAL_HEDGE_AFTER", 2.0))
+
+# Sharding. A process runs the SHARD_IDS out of SHARD_COUNT shards, or all of
+# them when unset. Processes started with `--processes` share admission
+# limits through the coordinator database and only the first one syncs the
+# slash commands.
+SHARD_COUNT = (
+    int(os.environ["FAL_SHARD_COUNT"]) if "FAL_SHARD_COUNT" in os.environ else None
+)
+SHARD_IDS = (
+    [int(shard_id) for shard_id in os.environ["FAL_SHARD_IDS"].split(",")]
+    if os.environ.get("FAL_SHARD_IDS")
+    else None
+)
+COORDINATOR_PATH = os.environ.get("FAL_COORDINATOR_PATH")
+SYNC_COMMANDS = os.environ.get("FAL_SYNC_COMMANDS", "1") == "1"
@@ -14,6 +14,8 @@ SD_SCHEDULERS = [
     "Euler A",
 ]
 
+FOOOCUS_MODES = ["Extreme Speed", "Speed", "Quality"]
+
 FOOOCUS_STYLES = [
     "Fooocus V2",
     "Fooocus Enhance",
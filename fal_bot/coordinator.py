@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import socket
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+
+from fal_bot import config
+from fal_bot.journal import INTERACTION_TOKEN_LIFETIME
+
+
+@dataclass
+class Coordinator:
+    """Shares the admission limits between bot processes (e.g. one per group
+    of shards) through a SQLite database on the local disk.
+
+    Every running job holds a lease row; leases expire with the interaction
+    token, so that a crashed process cannot hold on to its slots forever."""
+
+    path: str
+    max_in_flight: int = config.ADMISSION_MAX_IN_FLIGHT
+    max_per_user: int = config.ADMISSION_MAX_PER_USER
+    lease_ttl: float = INTERACTION_TOKEN_LIFETIME
+    poll_interval: float = 0.25
+    owner: str = field(default_factory=lambda: f"{socket.gethostname()}:{os.getpid()}")
+    _connection: sqlite3.Connection = field(init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False)
+
+    def __post_init__(self) -> None:
+        self._connection = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            "id INTEGER PRIMARY KEY, "
+            "endpoint TEXT NOT NULL, "
+            "user_id INTEGER NOT NULL, "
+            "owner TEXT NOT NULL, "
+            "expires_at REAL NOT NULL)"
+        )
+
+    def _try_acquire(self, endpoint: str, user_id: int) -> int | None:
+        now = time.time()
+        with self._lock:
+            # Takes the write lock up front so that counting and inserting
+            # happen atomically across processes.
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute(
+                    "DELETE FROM leases WHERE expires_at <= ?", (now,)
+                )
+                [running] = self._connection.execute(
+                    "SELECT COUNT(*) FROM leases WHERE endpoint = ?", (endpoint,)
+                ).fetchone()
+                [running_for_user] = self._connection.execute(
+                    "SELECT COUNT(*) FROM leases WHERE user_id = ?", (user_id,)
+                ).fetchone()
+                if running >= self.max_in_flight or (
+                    running_for_user >= self.max_per_user
+                ):
+                    lease = None
+                else:
+                    lease = self._connection.execute(
+                        "INSERT INTO leases (endpoint, user_id, owner, expires_at) "
+                        "VALUES (?, ?, ?, ?)",
+                        (endpoint, user_id, self.owner, now + self.lease_ttl),
+                    ).lastrowid
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+        return lease
+
+    def _release(self, lease: int) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM leases WHERE id = ?", (lease,))
+
+    def _release_abandoned(self, attempt: asyncio.Future[int | None]) -> None:
+        if not attempt.cancelled() and attempt.exception() is None:
+            if (lease := attempt.result()) is not None:
+                self._release(lease)
+
+    async def acquire(self, endpoint: str, user_id: int) -> int:
+        while True:
+            attempt = asyncio.ensure_future(
+                asyncio.to_thread(self._try_acquire, endpoint, user_id)
+            )
+            try:
+                lease = await asyncio.shield(attempt)
+            except asyncio.CancelledError:
+                attempt.add_done_callback(self._release_abandoned)
+                raise
+
+            if lease is not None:
+                return lease
+            await asyncio.sleep(self.poll_interval)
+
+    async def release(self, lease: int) -> None:
+        await asyncio.to_thread(self._release, lease)
+
+    async def aclose(self) -> None:
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM leases WHERE owner = ?", (self.owner,)
+            )
+            self._connection.close()
+
+
+def make_coordinator() -> Coordinator | None:
+    if config.COORDINATOR_PATH:
+        return Coordinator(config.COORDINATOR_PATH)
+    return None
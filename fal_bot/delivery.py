@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import importlib.util
+import logging
+import mimetypes
+import tempfile
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import IO
+
+import discord
+import httpx
+
+from fal_bot import config, metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _TooLarge(Exception):
+    pass
+
+
+@dataclass
+class _Download:
+    digest: str
+    extension: str
+    data: IO[bytes]
+
+
+@dataclass
+class Delivery:
+    """The images of one result message: `urls` are what its embeds show,
+    either ``attachment://`` references to `files` or previous uploads."""
+
+    store: ImageDelivery
+    urls: list[str] = field(default_factory=list)
+    files: list[discord.File] = field(default_factory=list)
+    # filename -> (source URL, content hash) of every file to upload
+    uploads: dict[str, tuple[str, str]] = field(default_factory=dict)
+
+    def remember(self, message: discord.Message | None) -> None:
+        for attachment in getattr(message, "attachments", ()):
+            if (upload := self.uploads.get(attachment.filename)) is not None:
+                self.store.remember(*upload, attachment.url)
+
+    def close(self) -> None:
+        for file in self.files:
+            # discord.File never closes file objects it was given.
+            file.close()
+            file.fp.close()
+
+
+@dataclass
+class ImageDelivery:
+    """Re-hosts result images as attachments of the result message, so that
+    they keep working after fal's storage links expire and viewers don't
+    fetch them from there.
+
+    Images are streamed into spooled files, kept in memory up to
+    `memory_limit` bytes, with at most `concurrency` downloads (and
+    re-encodes) at once. Images larger than `max_size`, or which fail to
+    download, stay hotlinked. Uploaded URLs are remembered by source URL
+    and content hash, so the same image is only uploaded once while its
+    Discord URL is still valid."""
+
+    max_size: int = config.REHOST_MAX_SIZE
+    memory_limit: int = config.REHOST_MEMORY_LIMIT
+    concurrency: int = config.REHOST_CONCURRENCY
+    timeout: float = config.REHOST_TIMEOUT
+    # Re-encode to e.g. WEBP when it makes the image smaller (needs Pillow).
+    preview_format: str | None = config.REHOST_PREVIEW_FORMAT
+    preview_quality: int = config.REHOST_PREVIEW_QUALITY
+    cache_size: int = config.REHOST_CACHE_SIZE
+    cache_ttl: float = config.REHOST_CACHE_TTL
+    # source URL or "sha256:<digest>" -> (expires_at, Discord URL)
+    _uploaded: OrderedDict[str, tuple[float, str]] = field(
+        default_factory=OrderedDict, init=False, repr=False
+    )
+    _slots: asyncio.Semaphore = field(init=False, repr=False)
+    _session: httpx.AsyncClient | None = field(default=None, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self._slots = asyncio.Semaphore(self.concurrency)
+        if self.preview_format and importlib.util.find_spec("PIL") is None:
+            logger.warning("Pillow is not installed, images won't be re-encoded.")
+            self.preview_format = None
+
+    def _client(self) -> httpx.AsyncClient:
+        # Result URLs point to public storage; the fal credentials stay out.
+        if self._session is None:
+            self._session = httpx.AsyncClient(
+                follow_redirects=True, timeout=self.timeout
+            )
+        return self._session
+
+    def _lookup(self, key: str) -> str | None:
+        entry = self._uploaded.get(key)
+        if entry is None or entry[0] <= time.time():
+            self._uploaded.pop(key, None)
+            return None
+
+        self._uploaded.move_to_end(key)
+        return entry[1]
+
+    def remember(self, source_url: str, digest: str, url: str) -> None:
+        expires_at = time.time() + self.cache_ttl
+        for key in (source_url, f"sha256:{digest}"):
+            self._uploaded[key] = (expires_at, url)
+            self._uploaded.move_to_end(key)
+        while len(self._uploaded) > self.cache_size:
+            self._uploaded.popitem(last=False)
+
+    async def prepare(self, image_urls: list[str]) -> Delivery:
+        delivery = Delivery(self)
+        missing = [
+            url for url in dict.fromkeys(image_urls) if self._lookup(url) is None
+        ]
+        downloads = dict(zip(missing, await asyncio.gather(*map(self._fetch, missing))))
+
+        filenames: dict[str, str] = {}
+        for position, image_url in enumerate(image_urls):
+            if (download := downloads.get(image_url)) is None:
+                url = self._lookup(image_url)
+                url, outcome = (
+                    (image_url, "hotlinked") if url is None else (url, "cached")
+                )
+            elif download.digest in filenames:
+                # Identical images within the message are uploaded once.
+                url, outcome = f"attachment://{filenames[download.digest]}", "cached"
+            elif (url := self._lookup(f"sha256:{download.digest}")) is not None:
+                outcome = "cached"
+            else:
+                filename = f"image-{position}{download.extension}"
+                filenames[download.digest] = filename
+                delivery.files.append(discord.File(download.data, filename))
+                delivery.uploads[filename] = (image_url, download.digest)
+                url, outcome = f"attachment://{filename}", "uploaded"
+
+            delivery.urls.append(url)
+            metrics.REHOSTED_IMAGES.labels(outcome=outcome).inc()
+
+        uploading = {id(file.fp) for file in delivery.files}
+        for download in downloads.values():
+            if download is not None and id(download.data) not in uploading:
+                download.data.close()
+        return delivery
+
+    async def _fetch(self, image_url: str) -> _Download | None:
+        async with self._slots:
+            try:
+                download = await asyncio.wait_for(
+                    self._download(image_url), self.timeout
+                )
+                if self.preview_format is not None:
+                    await asyncio.to_thread(self._reencode, download)
+                return download
+            except (asyncio.TimeoutError, httpx.HTTPError, _TooLarge) as exc:
+                logger.info("Not re-hosting %s: %r", image_url, exc)
+                return None
+
+    async def _download(self, image_url: str) -> _Download:
+        digest = hashlib.sha256()
+        data = tempfile.SpooledTemporaryFile(max_size=self.memory_limit)
+        try:
+            async with self._client().stream("GET", image_url) as response:
+                response.raise_for_status()
+                # A malformed length is not trusted; the size is counted below.
+                content_length = response.headers.get("Content-Length", "")
+                if content_length.isdigit() and int(content_length) > self.max_size:
+                    raise _TooLarge(content_length)
+
+                size = 0
+                async for chunk in response.aiter_bytes():
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise _TooLarge(size)
+                    digest.update(chunk)
+                    data.write(chunk)
+        except BaseException:
+            data.close()
+            raise
+
+        content_type = response.headers.get("Content-Type", "").partition(";")[0]
+        extension = (
+            mimetypes.guess_extension(content_type)
+            or mimetypes.guess_extension(mimetypes.guess_type(image_url)[0] or "")
+            or ".png"
+        )
+        data.seek(0)
+        return _Download(digest.hexdigest(), extension, data)
+
+    def _reencode(self, download: _Download) -> None:
+        from PIL import Image
+
+        preview = tempfile.SpooledTemporaryFile(max_size=self.memory_limit)
+        try:
+            with Image.open(download.data) as image:
+                image.save(
+                    preview, format=self.preview_format, quality=self.preview_quality
+                )
+        except (OSError, ValueError) as exc:
+            logger.info("Could not re-encode an image: %r", exc)
+            preview.close()
+            download.data.seek(0)
+            return
+
+        if preview.tell() >= download.data.seek(0, 2):
+            preview.close()
+            download.data.seek(0)
+            return
+
+        download.data.close()
+        preview.seek(0)
+        download.data = preview
+        download.extension = f".{self.preview_format.lower()}"  # type: ignore
+
+    async def aclose(self) -> None:
+        self._uploaded.clear()
+        if self._session is not None:
+            await self._session.aclose()
+            self._session = None
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+import discord
+
+from fal_bot import config, metrics
+
+
+class InteractionGone(Exception):
+    pass
+
+
+@dataclass
+class WebhookResponse:
+    # Stands in for an Interaction when all that is left of it is the
+    # webhook token, e.g. after a restart.
+    webhook: discord.Webhook
+    client: discord.Client | None = None
+
+    async def edit_original_response(self, **kwargs: Any) -> discord.WebhookMessage:
+        # "@original" addresses the interaction's initial response.
+        return await self.webhook.edit_message("@original", **kwargs)  # type: ignore
+
+
+@dataclass
+class MessageEditor:
+    """Latest-wins editor for an interaction's original response.
+
+    At most one edit is in flight and at most one is pending; newer
+    states replace the pending one, unchanged states are dropped and
+    consecutive edits are spaced by at least `min_interval` seconds."""
+
+    interaction: discord.Interaction | WebhookResponse
+    min_interval: float = config.DISCORD_EDIT_INTERVAL
+    edits: int = field(default=0, init=False)
+    _last: dict[str, Any] | None = field(default=None, init=False, repr=False)
+    _pending: dict[str, Any] | None = field(default=None, init=False, repr=False)
+    _last_edit_at: float = field(default=float("-inf"), init=False, repr=False)
+    _task: asyncio.Task[None] | None = field(default=None, init=False, repr=False)
+    _flushing: asyncio.Event = field(
+        default_factory=asyncio.Event, init=False, repr=False
+    )
+    _error: BaseException | None = field(default=None, init=False, repr=False)
+
+    @property
+    def gone(self) -> bool:
+        # The message was deleted or the interaction token has expired, so
+        # nobody is going to see any further edits.
+        if isinstance(self._error, discord.NotFound):
+            return True
+
+        is_expired = getattr(self.interaction, "is_expired", None)
+        return is_expired is not None and is_expired()
+
+    def edit(self, **kwargs: Any) -> None:
+        if self._error is not None:
+            return
+
+        latest = self._pending if self._pending is not None else self._last
+        if kwargs == latest:
+            return
+
+        self._pending = kwargs
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def flush(self) -> None:
+        # Deliver whatever is pending right away, ignoring the interval.
+        self._flushing.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+        if self._error is not None and not self.gone:
+            raise self._error
+
+    async def _run(self) -> None:
+        while self._pending is not None:
+            delay = self._last_edit_at + self.min_interval - time.monotonic()
+            if delay > 0 and not self._flushing.is_set():
+                try:
+                    await asyncio.wait_for(self._flushing.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+
+            kwargs, self._pending = self._pending, None
+            if kwargs is None or kwargs == self._last:
+                continue
+
+            try:
+                with metrics.DISCORD_EDIT_LATENCY.labels().time():
+                    await self.interaction.edit_original_response(**kwargs)
+            except discord.HTTPException as exc:
+                self._error = exc
+                self._pending = None
+                return
+
+            self.edits += 1
+            self._last = kwargs
+            self._last_edit_at = time.monotonic()
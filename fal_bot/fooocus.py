@@ -1,18 +1,20 @@
-from dataclasses import dataclass
-from typing import Any, Literal
+import functools
+import time
+from typing import Any
 
 import discord
-from discord import app_commands
 
-from fal_bot import utils
-from fal_bot.consts import FOOOCUS_ASPECT_RATIOS, FOOOCUS_STYLES
-
-FOOOCUS_BASE_URL = "https://110602490-fooocus.gateway.alpha.fal.ai"
+from fal_bot import registry, utils
+from fal_bot.consts import FOOOCUS_ASPECT_RATIOS, FOOOCUS_MODES, FOOOCUS_STYLES
+from fal_bot.editor import WebhookResponse
+from fal_bot.journal import INTERACTION_TOKEN_LIFETIME
+from fal_bot.view_state import ViewState
 
 DEFAULT_STYLES = FOOOCUS_STYLES[:24]
 KEEP_STYLE = "keep"
 
 
+@functools.cache
 def style_selector() -> list[discord.SelectOption]:
     options = [
         discord.SelectOption(
@@ -31,93 +33,123 @@ def style_selector() -> list[discord.SelectOption]:
     return options
 
 
-@dataclass
-class RegenerateView(discord.ui.View):
-    original_interaction: discord.Interaction
-    options: dict[str, Any]
-
-    def __post_init__(self) -> None:
-        super().__init__()
-
-    async def remove_view(self) -> None:
-        await self.original_interaction.edit_original_response(view=None)
-
-    async def on_timeout(self) -> None:
-        await self.remove_view()
-        await super().on_timeout()
+def pack_options(options: dict[str, Any]) -> str:
+    # Fits the options into a custom_id (at most 100 characters) as list
+    # indices; anything that is not in a list is read back off the embed.
+    def index(values: list[str], value: str) -> str:
+        return str(values.index(value)) if value in values else ""
 
-    @discord.ui.select(
-        placeholder="Change style",
-        min_values=1,
-        max_values=1,
-        options=style_selector(),
+    return ".".join(
+        [
+            index(FOOOCUS_STYLES, options["style"]),
+            index(FOOOCUS_MODES, options["mode"]),
+            index(FOOOCUS_ASPECT_RATIOS, options["aspect_ratio"]),
+            str(options.get("count", 1)),
+        ]
     )
-    async def with_style(
-        self,
-        interaction: discord.Interaction,
-        select: discord.ui.Select,
-    ):
-        await self.remove_view()
-
-        options = self.options
 
-        [style] = select.values
-        if style != KEEP_STYLE:
-            options["style"] = style
 
-        await command.callback(interaction, **self.options)
+def unpack_options(packed: str, message: discord.Message | None) -> dict[str, Any]:
+    fields = {}
+    if message is not None and message.embeds:
+        fields = {field.name: field.value for field in message.embeds[0].fields}
+
+    style, mode, aspect_ratio, count = packed.split(".")
+    return {
+        "prompt": fields.get("Prompt", ""),
+        "style": FOOOCUS_STYLES[int(style)] if style else fields["Style"],
+        "mode": FOOOCUS_MODES[int(mode)] if mode else fields["Mode"],
+        "aspect_ratio": (
+            FOOOCUS_ASPECT_RATIOS[int(aspect_ratio)]
+            if aspect_ratio
+            else fields["Aspect Ratio"]
+        ),
+        "count": int(count),
+    }
 
 
-@app_commands.command(
-    name="fooocus",
-    description="Generate an image from the given prompt with the Fooocus model.",
-)
-@app_commands.autocomplete(style=utils.autocomplete_from(FOOOCUS_STYLES))
-@app_commands.autocomplete(aspect_ratio=utils.autocomplete_from(FOOOCUS_ASPECT_RATIOS))
-async def command(
+async def remove_view(
     interaction: discord.Interaction,
-    prompt: str,
-    style: str = "Fooocus Cinematic",
-    mode: Literal["Extreme Speed", "Speed", "Quality"] = "Speed",
-    aspect_ratio: str = "1024x1024",
-):
-    await interaction.response.send_message("Your request has been received.")
-    with utils.Timed() as timer:
-        result = await utils.submit_interactive_task(
-            interaction,
-            FOOOCUS_BASE_URL,
-            prompt=prompt,
-            styles=[style],
-            performance=mode,
-            aspect_ratio=aspect_ratio,
+    state: ViewState | None,
+) -> None:
+    # The original response can be edited with its token for as long as it
+    # is valid, which does not need any channel permissions.
+    if state is not None and time.time() - state.created_at < (
+        INTERACTION_TOKEN_LIFETIME - 60
+    ):
+        webhook = discord.Webhook.partial(
+            state.application_id, state.token, client=interaction.client
+        )
+        await WebhookResponse(webhook).edit_original_response(view=None)
+    elif interaction.message is not None:
+        await interaction.message.edit(view=None)
+
+
+async def on_component(interaction: discord.Interaction, custom_id: str) -> None:
+    # Dispatched by the bot for select menus from make_view, including
+    # those on messages sent before a restart.
+    key, packed = custom_id.split(":", 1)
+    store = getattr(interaction.client, "view_states", None)
+    state = store.pop(key) if store is not None else None
+    if state is not None:
+        options = state.options
+    else:
+        options = unpack_options(packed, interaction.message)
+
+    if not await utils.accept_generation(interaction):
+        return
+
+    await remove_view(interaction, state)
+
+    [style] = (interaction.data or {}).get("values", [KEEP_STYLE])  # type: ignore
+    if style != KEEP_STYLE:
+        options["style"] = style
+
+    command = registry.ENDPOINTS["fooocus"].command
+    await command.callback(interaction, **options)  # type: ignore
+
+
+def build_payload(options: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "prompt": options["prompt"],
+        "styles": [options["style"]],
+        "performance": options["mode"],
+        "aspect_ratio": options["aspect_ratio"],
+    }
+
+
+def embed_fields(options: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "Style": options["style"],
+        "Mode": options["mode"],
+        "Aspect Ratio": options["aspect_ratio"],
+    }
+
+
+def make_view(
+    client: discord.Client,
+    application_id: int,
+    token: str,
+    options: dict[str, Any],
+    *,
+    issued_at: float | None = None,
+) -> discord.ui.View:
+    key = ""
+    store = getattr(client, "view_states", None)
+    if store is not None:
+        key = store.add(ViewState(application_id, token, options, issued_at))
+
+    view = discord.ui.View(timeout=None)
+    view.add_item(
+        discord.ui.Select(
+            custom_id=f"fooocus:{key}:{pack_options(options)}",
+            placeholder="Change style",
+            min_values=1,
+            max_values=1,
+            options=style_selector(),
         )
-
-    if result is None:
-        return None
-
-    embed = utils.make_prompted_image_embed(
-        title="Fooocus Image",
-        image_url=result["images"][0]["url"],
-        prompt=prompt,
-        fields={
-            "Style": style,
-            "Mode": mode,
-            "Aspect Ratio": aspect_ratio,
-            "Time Taken": f"{timer.elapsed:.2f}s",
-            "Generated by": interaction.user.mention,
-        },
-    )
-
-    await interaction.edit_original_response(
-        content=None,
-        embed=embed,
-        view=RegenerateView(
-            interaction,
-            options={
-                "prompt": prompt,
-                "style": style,
-                "mode": mode,
-                "aspect_ratio": aspect_ratio,
-            },
-        ),
     )
+    # Clicks are dispatched through on_component, so the view is only used
+    # to render the menu; a stopped view is not kept around by discord.py.
+    view.stop()
+    return view
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any
+
+from fal_bot import config
+
+# Discord invalidates interaction tokens after 15 minutes, after which
+# there is no way left to deliver a result.
+INTERACTION_TOKEN_LIFETIME = 15 * 60
+
+
+@dataclass
+class JournalEntry:
+    token: str
+    application_id: int
+    request_id: str
+    url: str
+    command: str
+    options: dict[str, Any]
+    user_mention: str
+    submitted_at: float = field(default_factory=time.time)
+
+    @property
+    def expired(self) -> bool:
+        return time.time() - self.submitted_at >= INTERACTION_TOKEN_LIFETIME
+
+
+@dataclass
+class Journal:
+    """Append-only JSONL log of submitted requests, so that requests
+    which were still running when the bot stopped can be picked up again.
+
+    Records are buffered in memory and written by a background task, so
+    recording never blocks the submit path on disk I/O."""
+
+    path: str
+    flush_interval: float = 0.5
+    _buffer: list[str] = field(default_factory=list, init=False, repr=False)
+    _wakeup: asyncio.Event = field(default_factory=asyncio.Event, init=False)
+    _task: asyncio.Task[None] | None = field(default=None, init=False, repr=False)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._flush()
+
+    def submitted(self, entry: JournalEntry) -> None:
+        self._append({"event": "submitted", **asdict(entry)})
+
+    def finished(self, token: str) -> None:
+        self._append({"event": "finished", "token": token})
+
+    def _append(self, record: dict[str, Any]) -> None:
+        self._buffer.append(json.dumps(record) + "\n")
+        self._wakeup.set()
+
+    def _write(self, lines: list[str]) -> None:
+        with open(self.path, "a") as stream:
+            stream.writelines(lines)
+            stream.flush()
+            os.fsync(stream.fileno())
+
+    async def _flush(self) -> None:
+        lines, self._buffer = self._buffer, []
+        if lines:
+            await asyncio.to_thread(self._write, lines)
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            await self._flush()
+            await asyncio.sleep(self.flush_interval)
+
+    def _load(self) -> list[JournalEntry]:
+        pending: dict[str, JournalEntry] = {}
+        try:
+            with open(self.path) as stream:
+                for line in stream:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn write from an unclean shutdown.
+                        continue
+
+                    if record.pop("event") == "submitted":
+                        pending[record["token"]] = JournalEntry(**record)
+                    else:
+                        pending.pop(record["token"], None)
+        except FileNotFoundError:
+            return []
+
+        entries = [entry for entry in pending.values() if not entry.expired]
+
+        # Compact the journal down to what is still pending.
+        with open(self.path + ".tmp", "w") as stream:
+            for entry in entries:
+                stream.write(json.dumps({"event": "submitted", **asdict(entry)}))
+                stream.write("\n")
+        os.replace(self.path + ".tmp", self.path)
+        return entries
+
+    async def replay(self) -> list[JournalEntry]:
+        return await asyncio.to_thread(self._load)
+
+
+def make_journal() -> Journal | None:
+    if config.JOURNAL_PATH:
+        return Journal(config.JOURNAL_PATH)
+    return None
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import shutil
+import signal
+import sys
+import tempfile
+
+from fal_bot import config
+
+logger = logging.getLogger(__name__)
+
+
+def process_environment(index: int, processes: int, token: str) -> dict[str, str]:
+    shard_count = config.SHARD_COUNT or processes
+    environment = {
+        **os.environ,
+        "DISCORD_TOKEN": token,
+        "FAL_SHARD_COUNT": str(shard_count),
+        "FAL_SHARD_IDS": ",".join(map(str, range(index, shard_count, processes))),
+        # One process is enough to keep the slash commands up to date.
+        "FAL_SYNC_COMMANDS": "1" if index == 0 and config.SYNC_COMMANDS else "0",
+    }
+    # Each process replays only the requests it journaled itself.
+    if config.JOURNAL_PATH:
+        environment["FAL_JOURNAL_PATH"] = f"{config.JOURNAL_PATH}.{index}"
+    if config.METRICS_PORT:
+        environment["FAL_METRICS_PORT"] = str(config.METRICS_PORT + index)
+    return environment
+
+
+async def run_processes(
+    processes: int,
+    token: str,
+    *,
+    force_sync: bool = False,
+) -> int:
+    """Runs the bot as `processes` separate processes, each with its own
+    event loop and share of the shards. Admission limits and cached results
+    are shared through SQLite databases on the local disk."""
+
+    # A process without shards would be given all of them instead.
+    if config.SHARD_COUNT is not None and processes > config.SHARD_COUNT:
+        raise ValueError(
+            f"Can't split {config.SHARD_COUNT} shards across {processes} processes"
+        )
+
+    state = tempfile.mkdtemp(prefix="fal_bot-")
+    os.environ.setdefault(
+        "FAL_COORDINATOR_PATH", os.path.join(state, "coordinator.sqlite3")
+    )
+    os.environ.setdefault("FAL_RESULT_CACHE_PATH", os.path.join(state, "cache.sqlite3"))
+
+    arguments = [sys.executable, "-m", "fal_bot"]
+    if force_sync:
+        arguments.append("--force-sync")
+
+    children = [
+        await asyncio.create_subprocess_exec(
+            *arguments, env=process_environment(index, processes, token)
+        )
+        for index in range(processes)
+    ]
+    logger.info("Started %d bot processes", len(children))
+
+    def forward(signum: int) -> None:
+        for child in children:
+            if child.returncode is None:
+                child.send_signal(signum)
+
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, forward, signum)
+
+    # If one process dies the others keep serving their shards; the exit
+    # code reports the first failure once all of them are gone.
+    codes = await asyncio.gather(*(child.wait() for child in children))
+    shutil.rmtree(state, ignore_errors=True)
+    return next((code for code in codes if code), 0)
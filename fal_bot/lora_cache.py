@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import asyncio
+import ipaddress
+import logging
+import socket
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+
+import discord
+import httpx
+from discord import app_commands
+
+from fal_bot import config, metrics
+
+logger = logging.getLogger(__name__)
+
+# Discord rejects longer choice values, so such URLs are never suggested.
+MAX_CHOICE_LENGTH = 100
+MAX_REDIRECTS = 5
+
+
+def is_public_address(address: str) -> bool:
+    try:
+        return ipaddress.ip_address(address).is_global
+    except ValueError:
+        return False
+
+
+async def _resolve(host: str, port: int) -> list[str]:
+    infos = await asyncio.get_running_loop().getaddrinfo(
+        host, port, type=socket.SOCK_STREAM
+    )
+    return [info[4][0] for info in infos]
+
+
+async def _is_public(url: httpx.URL) -> bool:
+    # The bot must not be usable to probe its own network (e.g. the metrics
+    # endpoint or a cloud metadata service), so every host it is pointed to
+    # has to resolve to global addresses only.
+    if url.scheme not in ("http", "https") or not url.host:
+        return False
+    addresses = await _resolve(
+        url.host, url.port or (443 if url.scheme == "https" else 80)
+    )
+    return bool(addresses) and all(map(is_public_address, addresses))
+
+
+def _is_public_peer(response: httpx.Response) -> bool:
+    # The host is resolved again when connecting, and may then point
+    # somewhere else (DNS rebinding), so check where we actually ended up.
+    stream = response.extensions.get("network_stream")
+    address = stream.get_extra_info("server_addr") if stream is not None else None
+    return address is not None and is_public_address(address[0])
+
+
+def _total_size(response: httpx.Response) -> int | None:
+    # Ranged responses carry the full size in `Content-Range: bytes 0-0/<size>`.
+    if (content_range := response.headers.get("Content-Range")) is not None:
+        _, _, total = content_range.rpartition("/")
+        return int(total) if total.isdigit() else None
+    if (content_length := response.headers.get("Content-Length")) is not None:
+        return int(content_length) if content_length.isdigit() else None
+    return None
+
+
+@dataclass
+class LoraCache:
+    """Checks LoRA URLs before jobs using them are queued, so that a broken
+    link is reported right away rather than after waiting for a GPU.
+
+    Checked URLs are remembered (rejected ones for a shorter time). It also
+    keeps the recently used LoRAs of every guild, for autocomplete, and how
+    often each LoRA is used, e.g. to tell the backend which ones to keep
+    warm."""
+
+    max_entries: int = config.LORA_CACHE_SIZE
+    ttl: float = config.LORA_CACHE_TTL
+    negative_ttl: float = config.LORA_NEGATIVE_TTL
+    max_size: int = config.LORA_MAX_SIZE
+    timeout: float = config.LORA_PREFLIGHT_TIMEOUT
+    recent_per_guild: int = config.LORA_RECENT_PER_GUILD
+    popularity: Counter[str] = field(default_factory=Counter, init=False)
+    # url -> (expires_at, why it was rejected or None if it is valid)
+    _entries: OrderedDict[str, tuple[float, str | None]] = field(
+        default_factory=OrderedDict, init=False, repr=False
+    )
+    _checks: dict[str, asyncio.Future[str | None]] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    _recent: dict[int | None, OrderedDict[str, None]] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    _session: httpx.AsyncClient | None = field(default=None, init=False, repr=False)
+
+    def _client(self) -> httpx.AsyncClient:
+        # Deliberately not one of the gateway sessions: these requests go to
+        # arbitrary hosts and must not carry the fal credentials.
+        if self._session is None:
+            self._session = httpx.AsyncClient()
+        return self._session
+
+    async def check(self, url: str) -> str | None:
+        """Returns why the LoRA at `url` can't be used, or None if it can
+        (or could not be checked in time)."""
+
+        entry = self._entries.get(url)
+        if entry is not None and entry[0] > time.time():
+            self._entries.move_to_end(url)
+            metrics.LORA_PREFLIGHTS.labels(outcome="cached").inc()
+            return entry[1]
+
+        # Concurrent checks of the same URL share a single request.
+        if url not in self._checks:
+            self._checks[url] = asyncio.ensure_future(self._check(url))
+            self._checks[url].add_done_callback(lambda _: self._checks.pop(url, None))
+        return await asyncio.shield(self._checks[url])
+
+    async def _check(self, url: str) -> str | None:
+        try:
+            problem = await asyncio.wait_for(self._fetch(url), self.timeout)
+        except (asyncio.TimeoutError, httpx.TransportError, OSError) as exc:
+            # The backend may well be able to fetch it; let the job decide.
+            logger.info("Could not check LoRA %s: %r", url, exc)
+            metrics.LORA_PREFLIGHTS.labels(outcome="unchecked").inc()
+            return None
+
+        ttl = self.ttl if problem is None else self.negative_ttl
+        self._entries[url] = (time.time() + ttl, problem)
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+        outcome = "valid" if problem is None else "rejected"
+        metrics.LORA_PREFLIGHTS.labels(outcome=outcome).inc()
+        return problem
+
+    async def _fetch(self, url: str) -> str | None:
+        session = self._client()
+        # Redirects are followed by hand, to check every host on the way.
+        target = httpx.URL(url)
+        for _ in range(MAX_REDIRECTS + 1):
+            if not await _is_public(target):
+                return "The LoRA URL must point to a public host."
+
+            async with session.stream("HEAD", target) as response:
+                public = _is_public_peer(response)
+            if public and response.status_code in (403, 405, 501):
+                # Some hosts (e.g. presigned object storage) only allow GETs;
+                # ask for a single byte so that only the headers are sent.
+                async with session.stream(
+                    "GET", target, headers={"Range": "bytes=0-0"}
+                ) as response:
+                    public = _is_public_peer(response)
+            if not public:
+                return "The LoRA URL must point to a public host."
+
+            if not response.is_redirect:
+                break
+            target = target.join(response.headers["Location"])
+        else:
+            return "The LoRA URL redirects too many times."
+
+        if response.is_error:
+            return f"The LoRA URL returned HTTP {response.status_code}."
+
+        content_type = response.headers.get("Content-Type", "")
+        if content_type.startswith("text/"):
+            # Typically the web page of a model instead of its download link.
+            return "The LoRA URL points to a web page, not a weights file."
+
+        size = _total_size(response)
+        if size is not None and size > self.max_size:
+            return (
+                f"The LoRA is too large ({size / 2**20:.0f} MiB, the limit is "
+                f"{self.max_size / 2**20:.0f} MiB)."
+            )
+        return None
+
+    def record_use(self, guild_id: int | None, url: str) -> None:
+        self.popularity[url] += 1
+        recent = self._recent.setdefault(guild_id, OrderedDict())
+        recent[url] = None
+        recent.move_to_end(url, last=False)
+        while len(recent) > self.recent_per_guild:
+            recent.popitem()
+
+    def recent(self, guild_id: int | None) -> list[str]:
+        return list(self._recent.get(guild_id, ()))
+
+    def most_popular(self, count: int = 10) -> list[tuple[str, int]]:
+        return self.popularity.most_common(count)
+
+    async def aclose(self) -> None:
+        if self._session is not None:
+            await self._session.aclose()
+            self._session = None
+
+
+async def autocomplete_recent(
+    interaction: discord.Interaction,
+    current: str,
+) -> list[app_commands.Choice[str]]:
+    lora_cache: LoraCache | None = getattr(interaction.client, "lora_cache", None)
+    if lora_cache is None:
+        return []
+
+    query = current.strip().lower()
+    return [
+        app_commands.Choice(name=url, value=url)
+        for url in lora_cache.recent(interaction.guild_id)
+        if query in url.lower() and len(url) <= MAX_CHOICE_LENGTH
+    ][:25]
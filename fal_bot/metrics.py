@@ -0,0 +1,289 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, ClassVar, Iterator
+
+from aiohttp import web
+
+from fal_bot import config
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return "{" + pairs + "}"
+
+
+@dataclass
+class _Metric:
+    kind: ClassVar[str]
+
+    name: str
+    documentation: str
+    labelnames: tuple[str, ...] = ()
+    _children: dict[tuple[str, ...], Any] = field(
+        default_factory=dict, init=False, repr=False
+    )
+
+    def __post_init__(self) -> None:
+        REGISTRY.append(self)
+
+    def labels(self, **labels: Any) -> Any:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        if key not in self._children:
+            self._children[key] = self._new_child()
+        return self._children[key]
+
+    def _new_child(self) -> Any:
+        raise NotImplementedError
+
+    def _samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        for key, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, key))
+            for suffix, extra, value in child.samples():
+                yield self.name + suffix, {**labels, **extra}, value
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, labels, value in self._samples():
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines)
+
+
+@dataclass
+class _Value:
+    value: float = 0.0
+    function: Callable[[], float] | None = None
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.function = function
+
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        yield "", {}, self.function() if self.function else self.value
+
+
+@dataclass
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+
+@dataclass
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+
+@dataclass
+class _Buckets:
+    bounds: tuple[float, ...]
+    counts: list[int] = field(init=False)
+    total: float = 0.0
+    count: int = 0
+
+    def __post_init__(self) -> None:
+        self.counts = [0] * len(self.bounds)
+
+    def observe(self, value: float) -> None:
+        self.total += value
+        self.count += 1
+        for index, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[index] += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start)
+
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        for bound, count in zip(self.bounds, self.counts):
+            yield "_bucket", {"le": str(bound)}, count
+        yield "_bucket", {"le": "+Inf"}, self.count
+        yield "_sum", {}, self.total
+        yield "_count", {}, self.count
+
+
+@dataclass
+class Histogram(_Metric):
+    kind = "histogram"
+
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS
+
+    def _new_child(self) -> _Buckets:
+        return _Buckets(self.buckets)
+
+
+REGISTRY: list[_Metric] = []
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+FAL_CALL_LATENCY = Histogram(
+    "fal_bot_gateway_call_seconds",
+    "Latency of calls to the fal queue API.",
+    ("endpoint", "operation"),
+)
+FAL_CALL_ERRORS = Counter(
+    "fal_bot_gateway_call_errors_total",
+    "Failed calls to the fal queue API.",
+    ("endpoint", "operation"),
+)
+GATEWAY_CIRCUIT_OPEN = Gauge(
+    "fal_bot_gateway_circuit_open",
+    "Whether calls to a gateway are currently being refused.",
+    ("endpoint",),
+)
+GATEWAY_CALL_RETRIES = Counter(
+    "fal_bot_gateway_call_retries_total",
+    "Retried calls to the fal queue API.",
+    ("endpoint", "operation"),
+)
+GATEWAY_HEDGED_SUBMITS = Counter(
+    "fal_bot_gateway_hedged_submits_total",
+    "Submits also sent to an alternate gateway, by which one won.",
+    ("endpoint", "winner"),
+)
+STATUS_STREAM_FALLBACKS = Counter(
+    "fal_bot_status_stream_fallbacks_total",
+    "Status streams that broke off and were replaced by polling.",
+    ("endpoint",),
+)
+JOB_PHASE_LATENCY = Histogram(
+    "fal_bot_job_phase_seconds",
+    "Time spent by generation jobs in each phase of their lifecycle.",
+    ("command", "model", "mode", "phase"),
+)
+JOB_STATUS_POLLS = Histogram(
+    "fal_bot_job_status_polls",
+    "Number of status updates received per generation job.",
+    ("command", "model", "mode"),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+JOBS_TOTAL = Counter(
+    "fal_bot_jobs_total",
+    "Generation jobs by outcome.",
+    ("command", "model", "mode", "outcome"),
+)
+JOBS_IN_FLIGHT = Gauge(
+    "fal_bot_jobs_in_flight",
+    "Generation jobs currently being handled.",
+    ("command",),
+)
+DISCORD_EDIT_LATENCY = Histogram(
+    "fal_bot_discord_edit_seconds",
+    "Latency of edits to interaction responses.",
+)
+STATUS_POLLER_WATCHES = Gauge(
+    "fal_bot_status_poller_watches",
+    "Requests currently tracked by the status poller.",
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "fal_bot_admission_in_flight",
+    "Admitted generation jobs per endpoint.",
+    ("endpoint",),
+)
+ADMISSION_WAITING = Gauge(
+    "fal_bot_admission_waiting",
+    "Generation jobs waiting for admission per endpoint and priority lane.",
+    ("endpoint", "lane"),
+)
+ADMISSION_WAIT = Histogram(
+    "fal_bot_admission_wait_seconds",
+    "Time generation jobs spent waiting for admission.",
+    ("endpoint", "lane"),
+)
+RESULT_CACHE_LOOKUPS = Counter(
+    "fal_bot_result_cache_lookups_total",
+    "Result cache lookups by outcome.",
+    ("outcome",),
+)
+LORA_PREFLIGHTS = Counter(
+    "fal_bot_lora_preflights_total",
+    "LoRA URL checks before submitting, by outcome.",
+    ("outcome",),
+)
+REHOSTED_IMAGES = Counter(
+    "fal_bot_rehosted_images_total",
+    "Result images by how they were delivered.",
+    ("outcome",),
+)
+EVENT_LOOP_LAG = Histogram(
+    "fal_bot_event_loop_lag_seconds",
+    "How late the event loop woke up a periodic probe.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+
+
+@dataclass
+class PhaseTimer:
+    # Records how long a job stayed in each phase as it moves between them.
+    labels: dict[str, Any]
+    _phase: str | None = field(default=None, init=False)
+    _since: float = field(default=0.0, init=False)
+
+    def enter(self, phase: str | None) -> None:
+        if phase == self._phase:
+            return
+
+        now = time.monotonic()
+        if self._phase is not None:
+            JOB_PHASE_LATENCY.labels(**self.labels, phase=self._phase).observe(
+                now - self._since
+            )
+        self._phase, self._since = phase, now
+
+
+async def monitor_event_loop_lag(interval: float = 0.25) -> None:
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.labels().observe(time.monotonic() - start - interval)
+
+
+async def start_metrics_server(
+    host: str = config.METRICS_HOST,
+    port: int = config.METRICS_PORT,
+) -> web.AppRunner:
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=render(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -1,19 +1,40 @@
 from __future__ import annotations
 
 import asyncio
-from contextlib import asynccontextmanager
-from dataclasses import dataclass, field
-from typing import Any, AsyncIterator, Awaitable, Callable
+import functools
+import hashlib
+import json
+import random
+import time
+from collections import deque
+from contextlib import AsyncExitStack, aclosing, asynccontextmanager, contextmanager
+from dataclasses import dataclass, field, replace
+from email.utils import parsedate_to_datetime
+from itertools import islice
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterator,
+    Protocol,
+    TypeAlias,
+    TypeVar,
+)
 
 import httpx
 from httpx import HTTPStatusError
 
-from fal_bot import config
+from fal_bot import config, metrics
+
+T = TypeVar("T")
 
 
 @dataclass
 class _Status:
-    ...
+    # Seconds the server asked us to wait before polling again, if any.
+    retry_after: float | None = field(default=None, kw_only=True, repr=False)
 
 
 @dataclass
@@ -31,76 +52,956 @@ class Completed(_Status):
     ...
 
 
+def _log_key(log: dict[str, Any]) -> tuple[Any, Any]:
+    return log.get("timestamp"), log.get("message")
+
+
+@dataclass
+class LogBuffer:
+    # Tracks how far into a request's log stream we are, and keeps only
+    # the most recent non-empty lines around for rendering.
+    max_lines: int = 20
+    seen: int = 0
+    lines: deque[str] = field(init=False, repr=False)
+    _last: tuple[Any, Any] | None = field(default=None, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.lines = deque(maxlen=self.max_lines)
+
+    @property
+    def cursor(self) -> str | None:
+        if self._last is None:
+            return None
+        return self._last[0]
+
+    def accept(self, logs: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        # The server is asked to only send entries after our cursor, but
+        # if it ignored that and sent the whole history, drop what we
+        # already have.
+        if (
+            self.seen
+            and len(logs) >= self.seen
+            and _log_key(logs[self.seen - 1]) == self._last
+        ):
+            logs = logs[self.seen :]
+
+        for log in logs:
+            if message := log["message"].strip():
+                self.lines.append(message)
+
+        if logs:
+            self.seen += len(logs)
+            self._last = _log_key(logs[-1])
+        return logs
+
+    def tail(self, count: int) -> list[str]:
+        lines = list(islice(reversed(self.lines), count))
+        lines.reverse()
+        return lines
+
+
 @dataclass
 class RequestHandle:
     request_id: str
+    logs: LogBuffer = field(default_factory=LogBuffer, repr=False, compare=False)
+    # The alternate gateway's client, when a hedged submit landed there.
+    via: QueueClient | None = field(default=None, repr=False, compare=False)
+
+
+class CircuitOpen(Exception):
+    def __init__(self, endpoint: str, retry_in: float) -> None:
+        super().__init__(f"{endpoint} is unavailable, retrying in {retry_in:.0f}s")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+class StreamingUnsupported(Exception):
+    pass
+
+
+# Endpoints that answered a status stream request with a 404, which are
+# polled right away from then on.
+_STREAMING_UNSUPPORTED: set[str] = set()
+
+# Errors that end a request and are reported back to the user.
+GatewayError: TypeAlias = HTTPStatusError | httpx.TransportError | CircuitOpen
+
+
+def _is_failure(exc: BaseException) -> bool:
+    # Only errors that say something about the gateway's health; a 4xx is
+    # a perfectly healthy answer to a bad request.
+    if isinstance(exc, HTTPStatusError):
+        return exc.response.status_code >= 500
+    return isinstance(exc, httpx.TransportError)
+
+
+@dataclass
+class CircuitBreaker:
+    """Refuses calls to a gateway after `failure_threshold` consecutive
+    failures. Once `reset_timeout` has passed a single probe call is let
+    through (half-open), and its outcome closes or re-opens the circuit."""
+
+    endpoint: str
+    failure_threshold: int = config.BREAKER_FAILURE_THRESHOLD
+    reset_timeout: float = config.BREAKER_RESET_TIMEOUT
+    failures: int = field(default=0, init=False)
+    opened_at: float | None = field(default=None, init=False)
+    _probing: bool = field(default=False, init=False, repr=False)
+
+    def check(self) -> None:
+        if self.opened_at is None:
+            return
+
+        retry_in = self.opened_at + self.reset_timeout - time.monotonic()
+        if retry_in > 0 or self._probing:
+            raise CircuitOpen(self.endpoint, max(retry_in, 0.0))
+
+    @property
+    def is_open(self) -> bool:
+        try:
+            self.check()
+        except CircuitOpen:
+            return True
+        return False
+
+    def acquire(self) -> bool:
+        # Returns whether the call about to be made is the half-open probe.
+        self.check()
+        if self.opened_at is None:
+            return False
+
+        self._probing = True
+        return True
+
+    def record(self, exc: BaseException | None, *, probe: bool) -> None:
+        if probe:
+            self._probing = False
+
+        if exc is None or isinstance(exc, HTTPStatusError) and not _is_failure(exc):
+            self.failures, self.opened_at = 0, None
+        elif _is_failure(exc):
+            self.failures += 1
+            if probe or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+        metrics.GATEWAY_CIRCUIT_OPEN.labels(endpoint=self.endpoint).set(
+            self.opened_at is not None
+        )
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    attempts: int = config.RETRY_ATTEMPTS
+    base_delay: float = config.RETRY_BASE_DELAY
+    max_delay: float = 4.0
+
+    def delays(self) -> Iterator[float]:
+        # Full jitter exponential backoff between consecutive attempts.
+        for attempt in range(self.attempts - 1):
+            yield random.uniform(0, min(self.base_delay * 2**attempt, self.max_delay))
+
+    def backoff(self) -> float:
+        # Once the retries are spent, for calls that keep on trying.
+        return random.uniform(self.max_delay / 2, self.max_delay)
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+def _parse_retry_after(response: httpx.Response) -> float | None:
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+class PollStrategy(Protocol):
+    def next_delay(self, status: _Status, elapsed: float) -> float:
+        ...
+
+
+@dataclass(frozen=True)
+class FixedPolling:
+    interval: float = 0.2
+
+    def next_delay(self, status: _Status, elapsed: float) -> float:
+        return self.interval
+
+
+@dataclass(frozen=True)
+class AdaptivePolling:
+    # Queued requests back off linearly with their position, running
+    # requests slowly with their age; both are capped and jittered so
+    # that concurrent pollers don't fire in lockstep.
+    min_interval: float = 0.5
+    per_position: float = 0.5
+    max_queued_interval: float = 10.0
+    progress_growth: float = 0.05
+    max_progress_interval: float = 2.0
+    jitter: float = 0.2
+
+    def next_delay(self, status: _Status, elapsed: float) -> float:
+        if isinstance(status, Queued):
+            delay = self.min_interval + self.per_position * status.position
+            delay = min(delay, self.max_queued_interval)
+        else:
+            delay = self.min_interval + self.progress_growth * elapsed
+            delay = min(delay, self.max_progress_interval)
+
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+DEFAULT_POLL_STRATEGY: PollStrategy = AdaptivePolling()
+
+
+def _parse_status(
+    request: RequestHandle,
+    data: dict[str, Any],
+    retry_after: float | None = None,
+) -> _Status:
+    if data["status"] == "COMPLETED":
+        return Completed()
+    elif data["status"] == "IN_QUEUE":
+        return Queued(position=data["queue_position"], retry_after=retry_after)
+    elif data["status"] == "IN_PROGRESS":
+        return InProgress(
+            logs=request.logs.accept(data.get("logs") or []),
+            retry_after=retry_after,
+        )
+    else:
+        raise ValueError(f"Unknown status: {data['status']}")
+
+
+_orphans: set[asyncio.Task[Any]] = set()
+
+
+def _cancel_orphan(client: QueueClient, attempt: asyncio.Future[RequestHandle]) -> None:
+    # The losing side of a hedged submit may still have created a job.
+    if attempt.cancelled() or attempt.exception() is not None:
+        return
+
+    task = asyncio.ensure_future(client.cancel(attempt.result()))
+    task.add_done_callback(lambda task: task.cancelled() or task.exception())
+    _orphans.add(task)
+    task.add_done_callback(_orphans.discard)
 
 
 @dataclass
 class QueueClient:
     session: httpx.AsyncClient
+    breaker: CircuitBreaker | None = None
+    retry: RetryPolicy = DEFAULT_RETRY_POLICY
+    # Alternate gateway that submits are hedged to.
+    hedge: QueueClient | None = None
+    hedge_after: float = config.HEDGE_AFTER
+
+    @property
+    def url(self) -> str:
+        return str(self.session.base_url).rstrip("/").removesuffix("/fal/queue")
+
+    def ensure_available(self) -> None:
+        # Raises CircuitOpen if new requests have nowhere to go.
+        if self.breaker is not None and self.breaker.is_open:
+            if self.hedge is None:
+                self.breaker.check()
+            else:
+                self.hedge.ensure_available()
+
+    @contextmanager
+    def _observe(self, operation: str) -> Iterator[None]:
+        labels = {"endpoint": self.session.base_url.host, "operation": operation}
+        probe = self.breaker.acquire() if self.breaker is not None else False
+        try:
+            with metrics.FAL_CALL_LATENCY.labels(**labels).time():
+                yield
+        except BaseException as exc:
+            if self.breaker is not None:
+                self.breaker.record(exc, probe=probe)
+            if isinstance(exc, Exception):
+                metrics.FAL_CALL_ERRORS.labels(**labels).inc()
+            raise
+        else:
+            if self.breaker is not None:
+                self.breaker.record(None, probe=probe)
+
+    async def _with_retries(
+        self,
+        operation: str,
+        call: Callable[[], Awaitable[T]],
+        *,
+        patience: float = 0.0,
+    ) -> T:
+        # Only for idempotent calls. Without `patience` it gives up once the
+        # retries are spent or the circuit opens; with it, it keeps backing
+        # off (waiting for the circuit's probe) for up to that long.
+        deadline = time.monotonic() + patience
+        delays = list(self.retry.delays())
+        while True:
+            try:
+                return await call()
+            except CircuitOpen as exc:
+                if time.monotonic() + exc.retry_in >= deadline:
+                    raise
+                delay = exc.retry_in + self.retry.backoff()
+            except (HTTPStatusError, httpx.TransportError) as exc:
+                if not _is_failure(exc):
+                    raise
+                if delays:
+                    delay = delays.pop(0)
+                elif time.monotonic() < deadline:
+                    delay = self.retry.backoff()
+                else:
+                    raise
+
+            metrics.GATEWAY_CALL_RETRIES.labels(
+                endpoint=self.session.base_url.host, operation=operation
+            ).inc()
+            await asyncio.sleep(delay)
 
     async def submit(self, data: dict[str, Any]) -> RequestHandle:
-        response = await self.session.post("/submit/", json=data)
-        response.raise_for_status()
+        if self.hedge is not None:
+            return await self._hedged_submit(self.hedge, data)
+
+        with self._observe("submit"):
+            response = await self.session.post("/submit/", json=data)
+            response.raise_for_status()
 
         data = response.json()
         return RequestHandle(data["request_id"])
 
-    async def status(self, request: RequestHandle) -> _Status:
-        response = await self.session.get(
-            f"/requests/{request.request_id}/status?logs=1"
+    async def _hedged_submit(
+        self,
+        hedge: QueueClient,
+        data: dict[str, Any],
+    ) -> RequestHandle:
+        # Submits to this gateway, and also to the alternate one if this one
+        # is down, failing, or slower than `hedge_after`. The first job to be
+        # accepted wins and the other one is cancelled.
+        primary = replace(self, hedge=None)
+        attempts: dict[asyncio.Future[RequestHandle], QueueClient] = {}
+        if self.breaker is None or not self.breaker.is_open:
+            attempts[asyncio.ensure_future(primary.submit(data))] = self
+
+        hedged = False
+        error: BaseException | None = None
+        try:
+            while True:
+                if not hedged and (error is not None or not attempts):
+                    hedged = True
+                    attempts[asyncio.ensure_future(hedge.submit(data))] = hedge
+                if not attempts:
+                    raise error  # type: ignore[misc]
+
+                done, _ = await asyncio.wait(
+                    attempts,
+                    timeout=None if hedged else self.hedge_after,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    error = asyncio.TimeoutError()
+                for attempt in done:
+                    client = attempts.pop(attempt)
+                    if (error := attempt.exception()) is None:
+                        if hedged:
+                            metrics.GATEWAY_HEDGED_SUBMITS.labels(
+                                endpoint=self.session.base_url.host,
+                                winner="alternate" if client is hedge else "primary",
+                            ).inc()
+
+                        handle = attempt.result()
+                        if client is hedge:
+                            handle.via = hedge
+                        return handle
+                    elif not isinstance(error, CircuitOpen) and not _is_failure(error):
+                        raise error
+        finally:
+            for attempt, client in attempts.items():
+                attempt.add_done_callback(functools.partial(_cancel_orphan, client))
+
+    async def status(
+        self,
+        request: RequestHandle,
+        *,
+        patience: float = config.OUTAGE_PATIENCE,
+    ) -> _Status:
+        if request.via is not None and request.via is not self:
+            return await request.via.status(request, patience=patience)
+        return await self._with_retries(
+            "status", lambda: self._status(request), patience=patience
         )
-        response.raise_for_status()
+
+    async def _status(self, request: RequestHandle) -> _Status:
+        params: dict[str, Any] = {"logs": 1}
+        if cursor := request.logs.cursor:
+            params["logs_since"] = cursor
+
+        with self._observe("status"):
+            response = await self.session.get(
+                f"/requests/{request.request_id}/status", params=params
+            )
+            response.raise_for_status()
 
         if response.status_code == 200:
             return Completed()
 
-        data = response.json()
-        if data["status"] == "IN_QUEUE":
-            return Queued(position=data["queue_position"])
-        elif data["status"] == "IN_PROGRESS":
-            return InProgress(logs=data["logs"])
+        return _parse_status(request, response.json(), _parse_retry_after(response))
+
+    async def stream_status(
+        self,
+        request: RequestHandle,
+    ) -> AsyncGenerator[_Status, None]:
+        # Follows the endpoint's server-sent event stream, which carries the
+        # same payloads as the status endpoint, until the request completes.
+        params: dict[str, Any] = {"logs": 1}
+        if cursor := request.logs.cursor:
+            params["logs_since"] = cursor
+
+        async with AsyncExitStack() as stack:
+            # Only opening the stream is timed, and counts for the circuit.
+            with self._observe("stream"):
+                response = await stack.enter_async_context(
+                    self.session.stream(
+                        "GET",
+                        f"/requests/{request.request_id}/status/stream",
+                        params=params,
+                        timeout=httpx.Timeout(10.0, read=config.STATUS_STREAM_TIMEOUT),
+                    )
+                )
+                if response.status_code in (404, 405):
+                    raise StreamingUnsupported(self.url)
+                response.raise_for_status()
+
+            data: list[str] = []
+            async for line in response.aiter_lines():
+                line = line.rstrip("\r\n")
+                if line.startswith("data:"):
+                    data.append(line.removeprefix("data:").removeprefix(" "))
+                elif not line and data:
+                    status = _parse_status(request, json.loads("\n".join(data)))
+                    data = []
+                    yield status
+                    if isinstance(status, Completed):
+                        return
+
+        raise httpx.RemoteProtocolError("The status stream ended early")
+
+    async def stream_until_ready(
+        self,
+        request: RequestHandle,
+        *,
+        fallback: Callable[[], AsyncGenerator[Queued | InProgress, None]],
+    ) -> AsyncGenerator[Queued | InProgress, None]:
+        # Streams statuses when the endpoint supports it, and continues with
+        # the `fallback` poll loop if it does not or the stream breaks off.
+        if request.via is not None and request.via is not self:
+            client = request.via
         else:
-            raise ValueError(f"Unknown status: {data['status']}")
+            client = self
+
+        if client.url not in _STREAMING_UNSUPPORTED:
+            try:
+                async with aclosing(client.stream_status(request)) as statuses:
+                    async for status in statuses:
+                        if isinstance(status, Completed):
+                            return
+                        yield status  # type: ignore
+            except StreamingUnsupported:
+                _STREAMING_UNSUPPORTED.add(client.url)
+            except (httpx.HTTPError, ValueError):
+                metrics.STATUS_STREAM_FALLBACKS.labels(
+                    endpoint=client.session.base_url.host
+                ).inc()
+
+        async with aclosing(fallback()) as statuses:
+            async for status in statuses:
+                yield status
 
     async def result(self, request: RequestHandle) -> dict[str, Any]:
-        response = await self.session.get(f"/requests/{request.request_id}/response/")
-        response.raise_for_status()
+        if request.via is not None and request.via is not self:
+            return await request.via.result(request)
+        return await self._with_retries(
+            "result", lambda: self._result(request), patience=config.OUTAGE_PATIENCE
+        )
+
+    async def _result(self, request: RequestHandle) -> dict[str, Any]:
+        with self._observe("result"):
+            response = await self.session.get(
+                f"/requests/{request.request_id}/response/"
+            )
+            response.raise_for_status()
 
         data = response.json()
         return data
 
+    async def cancel(self, request: RequestHandle) -> bool:
+        if request.via is not None and request.via is not self:
+            return await request.via.cancel(request)
+
+        with self._observe("cancel"):
+            response = await self.session.put(f"/requests/{request.request_id}/cancel")
+            if response.status_code == 400:
+                # The request has already completed.
+                return False
+            response.raise_for_status()
+        return True
+
     async def poll_until_ready(
         self,
         request: RequestHandle,
         *,
-        __poll_delay: float = 0.2,
-    ) -> AsyncIterator[Queued | InProgress]:
+        strategy: PollStrategy = DEFAULT_POLL_STRATEGY,
+    ) -> AsyncGenerator[Queued | InProgress, None]:
+        time_start = time.monotonic()
+        status: _Status | None = None
         while True:
-            status = await self.status(request)
+            try:
+                status = await self.status(request)
+            except HTTPStatusError as exc:
+                # Being rate limited is not fatal for a poll loop as long as
+                # we have something to base the next delay on.
+                if exc.response.status_code != 429 or status is None:
+                    raise
+                status.retry_after = _parse_retry_after(exc.response)
+            else:
+                if isinstance(status, Completed):
+                    return
 
-            if isinstance(status, Completed):
-                return
+                yield status  # type: ignore
+
+            delay = strategy.next_delay(status, time.monotonic() - time_start)
+            if status.retry_after is not None:
+                delay = max(delay, status.retry_after)
+            await asyncio.sleep(delay)
+
+
+def canonical_key(url: str, data: dict[str, Any]) -> str:
+    payload = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(f"{url}\n{payload}".encode()).hexdigest()
+
+
+@dataclass
+class _Flight:
+    handle: asyncio.Future[RequestHandle]
+    callers: int = 0
+    result: asyncio.Future[dict[str, Any]] | None = None
+
+    def carries(self, request: RequestHandle) -> bool:
+        handle = self.handle
+        return (
+            handle.done()
+            and not handle.cancelled()
+            and handle.exception() is None
+            and handle.result() is request
+        )
+
+
+@dataclass
+class SingleFlight:
+    """Lets identical concurrent requests share one gateway job: the
+    first caller submits, everyone else with the same key attaches to
+    its RequestHandle and receives the same result."""
+
+    _flights: dict[str, _Flight] = field(default_factory=dict, init=False, repr=False)
+
+    async def submit(
+        self,
+        client: QueueClient,
+        key: str,
+        data: dict[str, Any],
+    ) -> RequestHandle:
+        if key not in self._flights:
+            flight = _Flight(asyncio.ensure_future(client.submit(data)))
+            flight.handle.add_done_callback(
+                lambda future: self._forget_failed(key, flight, future)
+            )
+            self._flights[key] = flight
+
+        flight = self._flights[key]
+        flight.callers += 1
+        return await asyncio.shield(flight.handle)
 
-            yield status  # type: ignore
-            await asyncio.sleep(__poll_delay)
+    def leave(self, key: str, request: RequestHandle) -> bool:
+        # Detaches a caller that no longer wants the result (or failed to
+        # get it), and tells it whether it was the last one (so the job can
+        # be cancelled).
+        flight = self._flights.get(key)
+        if flight is None or not flight.carries(request):
+            return True
+
+        flight.callers -= 1
+        if flight.callers > 0:
+            return False
+
+        self._forget(key, flight)
+        return True
+
+    async def result(
+        self,
+        client: QueueClient,
+        key: str,
+        request: RequestHandle,
+    ) -> dict[str, Any]:
+        flight = self._flights.get(key)
+        if flight is None:
+            return await client.result(request)
+
+        if flight.result is None:
+            joined = flight
+            flight.result = asyncio.ensure_future(client.result(request))
+            flight.result.add_done_callback(lambda _: self._forget(key, joined))
+
+        return await asyncio.shield(flight.result)
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def _forget_failed(
+        self,
+        key: str,
+        flight: _Flight,
+        future: asyncio.Future[Any],
+    ) -> None:
+        if future.cancelled() or future.exception() is not None:
+            self._forget(key, flight)
+
+
+def _make_session(url: str, **kwargs: Any) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=url + "/fal/queue",
+        headers={"Authorization": f"Key {config.FAL_SECRET}"},
+        **kwargs,
+    )
+
+
+@dataclass
+class ClientPool:
+    """Long-lived HTTP sessions, one per gateway base URL, so that
+    submits and status polls reuse warm (keep-alive) connections."""
+
+    limits: httpx.Limits = field(
+        default_factory=lambda: httpx.Limits(
+            max_connections=config.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+        )
+    )
+    http2: bool = config.HTTP2_ENABLED
+    _sessions: dict[str, httpx.AsyncClient] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    _breakers: dict[str, CircuitBreaker] = field(
+        default_factory=dict, init=False, repr=False
+    )
+
+    def get(self, url: str) -> httpx.AsyncClient:
+        if url not in self._sessions:
+            self._sessions[url] = _make_session(
+                url,
+                limits=self.limits,
+                http2=self.http2,
+            )
+        return self._sessions[url]
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        if url not in self._breakers:
+            self._breakers[url] = CircuitBreaker(httpx.URL(url).host)
+        return self._breakers[url]
+
+    async def aclose(self) -> None:
+        sessions, self._sessions = self._sessions, {}
+        await asyncio.gather(*(session.aclose() for session in sessions.values()))
+
+
+@asynccontextmanager
+async def _session_for(
+    url: str,
+    pool: ClientPool | None,
+) -> AsyncIterator[httpx.AsyncClient]:
+    if pool is not None:
+        yield pool.get(url)
+    else:
+        async with _make_session(url) as session:
+            yield session
 
 
 @asynccontextmanager
 async def queue_client(
     url: str,
     *,
-    on_error: Callable[[HTTPStatusError], Awaitable[None]] | None = None,
+    pool: ClientPool | None = None,
+    on_error: Callable[[GatewayError], Awaitable[None]] | None = None,
 ) -> AsyncIterator[QueueClient]:
-    async with httpx.AsyncClient(
-        base_url=url + "/fal/queue",
-        headers={"Authorization": f"Key {config.FAL_SECRET}"},
-    ) as client:
+    # Circuit breakers live as long as the pool, so they only apply to
+    # pooled clients.
+    async with AsyncExitStack() as stack:
+        hedge = None
+        if alternate := config.ALTERNATE_ENDPOINTS.get(url):
+            hedge = QueueClient(
+                await stack.enter_async_context(_session_for(alternate, pool)),
+                breaker=pool.breaker(alternate) if pool is not None else None,
+            )
+
+        client = QueueClient(
+            await stack.enter_async_context(_session_for(url, pool)),
+            breaker=pool.breaker(url) if pool is not None else None,
+            hedge=hedge,
+        )
         try:
-            yield QueueClient(client)
-        except HTTPStatusError as e:
+            yield client
+        except (HTTPStatusError, httpx.TransportError, CircuitOpen) as e:
             if on_error is None:
                 raise
             else:
                 await on_error(e)
+
+
+@dataclass
+class _Watch:
+    key: str
+    client: QueueClient
+    request: RequestHandle
+    strategy: PollStrategy
+    started_at: float
+    due_at: float
+    subscribers: list[asyncio.Queue[_Status | BaseException]] = field(
+        default_factory=list
+    )
+    last_status: _Status | None = None
+    in_flight: bool = False
+    failing_since: float | None = None
+    # Followed through a status stream rather than polled, while it lasts.
+    streaming: bool = False
+    task: asyncio.Task[None] | None = None
+
+
+@dataclass
+class StatusPoller:
+    """A single background sweep that polls every outstanding request
+    within a global concurrency and request-rate budget, and fans the
+    statuses out to whoever is waiting on them.
+
+    With `streaming`, requests are followed through the endpoint's status
+    stream instead (one per request, at most `max_streams` at once), and
+    polled when it has none or the stream breaks off."""
+
+    max_concurrency: int = config.STATUS_POLL_CONCURRENCY
+    requests_per_second: float = config.STATUS_POLL_RATE
+    idle_interval: float = 1.0
+    outage_patience: float = config.OUTAGE_PATIENCE
+    streaming: bool = config.STATUS_STREAMING
+    max_streams: int = config.STATUS_MAX_STREAMS
+    streams: int = field(default=0, init=False)
+    _watches: dict[str, _Watch] = field(default_factory=dict, init=False, repr=False)
+    _wakeup: asyncio.Event = field(default_factory=asyncio.Event, init=False)
+    _task: asyncio.Task[None] | None = field(default=None, init=False, repr=False)
+    _polls: set[asyncio.Task[None]] = field(default_factory=set, init=False, repr=False)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._watches)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        for task in list(self._polls):
+            task.cancel()
+
+        watches, self._watches = self._watches, {}
+        for watch in watches.values():
+            self._publish(watch, asyncio.CancelledError())
+
+    async def watch(
+        self,
+        client: QueueClient,
+        request: RequestHandle,
+        *,
+        strategy: PollStrategy = DEFAULT_POLL_STRATEGY,
+    ) -> AsyncGenerator[Queued | InProgress, None]:
+        key = f"{client.session.base_url}{request.request_id}"
+        if key not in self._watches:
+            now = time.monotonic()
+            self._watches[key] = _Watch(key, client, request, strategy, now, now)
+            self._watches[key].streaming = (
+                self.streaming
+                and (request.via or client).url not in _STREAMING_UNSUPPORTED
+            )
+            self._wakeup.set()
+
+        watch = self._watches[key]
+        queue: asyncio.Queue[_Status | BaseException] = asyncio.Queue()
+        watch.subscribers.append(queue)
+        if watch.last_status is not None:
+            queue.put_nowait(watch.last_status)
+
+        try:
+            while True:
+                status = await queue.get()
+                if isinstance(status, BaseException):
+                    raise status
+                if isinstance(status, Completed):
+                    return
+
+                yield status  # type: ignore
+        finally:
+            watch.subscribers.remove(queue)
+            if not watch.subscribers and self._watches.get(key) is watch:
+                del self._watches[key]
+                if watch.task is not None:
+                    watch.task.cancel()
+
+    def _publish(self, watch: _Watch, status: _Status | BaseException) -> None:
+        if isinstance(status, _Status):
+            watch.last_status = status
+        for queue in watch.subscribers:
+            queue.put_nowait(status)
+
+    def _finish(self, watch: _Watch, status: _Status | BaseException) -> None:
+        if self._watches.get(watch.key) is watch:
+            del self._watches[watch.key]
+        self._publish(watch, status)
+
+    async def _poll(self, watch: _Watch, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            try:
+                # Outages are waited out here, without holding on to a slot.
+                status = await watch.client.status(watch.request, patience=0.0)
+            except CircuitOpen as exc:
+                self._retry_later(watch, exc, exc.retry_in)
+                return
+            except HTTPStatusError as exc:
+                if exc.response.status_code == 429 and watch.last_status is not None:
+                    status = watch.last_status
+                    status.retry_after = _parse_retry_after(exc.response)
+                elif _is_failure(exc):
+                    self._retry_later(watch, exc, 0.0)
+                    return
+                else:
+                    self._finish(watch, exc)
+                    return
+            except httpx.TransportError as exc:
+                self._retry_later(watch, exc, 0.0)
+                return
+            except Exception as exc:
+                self._finish(watch, exc)
+                return
+            finally:
+                watch.in_flight = False
+
+        watch.failing_since = None
+
+        if isinstance(status, Completed):
+            self._finish(watch, status)
+            return
+
+        now = time.monotonic()
+        delay = watch.strategy.next_delay(status, now - watch.started_at)
+        if status.retry_after is not None:
+            delay = max(delay, status.retry_after)
+        watch.due_at = now + delay
+
+        self._publish(watch, status)
+        self._wakeup.set()
+
+    async def _stream(self, watch: _Watch) -> None:
+        client = watch.request.via or watch.client
+        self.streams += 1
+        try:
+            async with aclosing(client.stream_status(watch.request)) as statuses:
+                async for status in statuses:
+                    if isinstance(status, Completed):
+                        self._finish(watch, status)
+                        return
+                    self._publish(watch, status)
+        except StreamingUnsupported:
+            _STREAMING_UNSUPPORTED.add(client.url)
+        except CircuitOpen:
+            # Polling knows how to wait for the circuit.
+            pass
+        except (httpx.HTTPError, ValueError):
+            metrics.STATUS_STREAM_FALLBACKS.labels(
+                endpoint=client.session.base_url.host
+            ).inc()
+        finally:
+            self.streams -= 1
+            watch.in_flight = False
+            watch.task = None
+
+        watch.streaming = False
+        watch.due_at = time.monotonic()
+        self._wakeup.set()
+
+    def _retry_later(self, watch: _Watch, exc: Exception, delay: float) -> None:
+        now = time.monotonic()
+        if watch.failing_since is None:
+            watch.failing_since = now
+        if now - watch.failing_since >= self.outage_patience:
+            self._finish(watch, exc)
+            return
+
+        watch.due_at = now + delay + watch.client.retry.backoff()
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tokens, refilled_at = self.requests_per_second, time.monotonic()
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            tokens = min(
+                tokens + (now - refilled_at) * self.requests_per_second,
+                self.requests_per_second,
+            )
+            refilled_at = now
+
+            pending = sorted(
+                (watch for watch in self._watches.values() if not watch.in_flight),
+                key=lambda watch: watch.due_at,
+            )
+            for watch in pending:
+                if watch.due_at > now or tokens < 1:
+                    break
+
+                tokens -= 1
+                watch.in_flight = True
+                if watch.streaming and self.streams < self.max_streams:
+                    task = watch.task = asyncio.create_task(self._stream(watch))
+                else:
+                    watch.streaming = False
+                    task = asyncio.create_task(self._poll(watch, semaphore))
+                self._polls.add(task)
+                task.add_done_callback(self._polls.discard)
+
+            next_due = min(
+                (watch.due_at for watch in pending if not watch.in_flight),
+                default=now + self.idle_interval,
+            )
+            if tokens < 1:
+                next_due = max(next_due, now + (1 - tokens) / self.requests_per_second)
+
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), timeout=max(next_due - now, 0.0)
+                )
+            except asyncio.TimeoutError:
+                pass
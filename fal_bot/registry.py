@@ -0,0 +1,485 @@
+from __future__ import annotations
+
+import importlib
+import inspect
+import ipaddress
+from dataclasses import dataclass, field
+from types import ModuleType
+from typing import Any, Callable, Literal, get_args, get_origin
+from urllib.parse import urlsplit
+
+import discord
+from discord import app_commands
+
+from fal_bot import config, metrics, utils
+from fal_bot.consts import (
+    FOOOCUS_ASPECT_RATIOS,
+    FOOOCUS_MODES,
+    FOOOCUS_STYLES,
+    SD_MODELS,
+    SD_SCHEDULERS,
+)
+from fal_bot.delivery import ImageDelivery
+from fal_bot.editor import WebhookResponse
+from fal_bot.lora_cache import autocomplete_recent, is_public_address
+from fal_bot.queue_client import DEFAULT_POLL_STRATEGY, AdaptivePolling, PollStrategy
+
+
+class InvalidOption(ValueError):
+    pass
+
+
+def _is_ip_address(value: str) -> bool:
+    try:
+        ipaddress.ip_address(value)
+    except ValueError:
+        return False
+    return True
+
+
+def http_url(value: str | None) -> str | None:
+    if value is not None:
+        parts = urlsplit(value)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise InvalidOption(f"`{value}` is not an http(s) URL.")
+        if parts.hostname == "localhost" or (
+            _is_ip_address(parts.hostname) and not is_public_address(parts.hostname)
+        ):
+            raise InvalidOption(f"`{value}` does not point to a public host.")
+    return value
+
+
+@dataclass(frozen=True)
+class Parameter:
+    name: str
+    annotation: Any
+    default: Any = inspect.Parameter.empty
+    description: str | None = None
+    # Offered as autocomplete suggestions (the index is built on first use)
+    # and matched case-insensitively; other values are rejected if strict.
+    choices: list[str] | None = None
+    strict: bool = True
+    minimum: float | None = None
+    maximum: float | None = None
+    check: Callable[[Any], Any] | None = None
+    # Suggestions computed per interaction, instead of from `choices`.
+    autocomplete: utils.Autocomplete | None = None
+    _canonical: dict[str, str] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        choices: tuple[str, ...] = tuple(self.choices or ())
+        if get_origin(self.annotation) is Literal:
+            choices = get_args(self.annotation)
+
+        canonical = {choice.casefold(): choice for choice in choices}
+        object.__setattr__(self, "_canonical", canonical)
+
+    @property
+    def required(self) -> bool:
+        return self.default is inspect.Parameter.empty
+
+    @property
+    def slash_annotation(self) -> Any:
+        # Lets Discord enforce the bounds client side as well.
+        if self.minimum is not None or self.maximum is not None:
+            return app_commands.Range[self.annotation, self.minimum, self.maximum]
+        return self.annotation
+
+    def canonicalize(self, value: Any) -> Any:
+        # Equivalent inputs end up as the same value, so that they share
+        # cache keys and in-flight jobs.
+        if isinstance(value, str):
+            value = value.strip()
+            if not value:
+                if self.required:
+                    raise InvalidOption(f"`{self.name}` can't be empty.")
+                value = self.default
+
+        if self._canonical and isinstance(value, str):
+            if (choice := self._canonical.get(value.casefold())) is not None:
+                value = choice
+            elif self.strict:
+                raise InvalidOption(f"`{value}` is not a valid `{self.name}`.")
+
+        if isinstance(value, (int, float)) and not (
+            (self.minimum is None or value >= self.minimum)
+            and (self.maximum is None or value <= self.maximum)
+        ):
+            raise InvalidOption(
+                f"`{self.name}` must be between {self.minimum} and {self.maximum}."
+            )
+
+        if self.check is not None:
+            value = self.check(value)
+        return value
+
+
+COUNT = Parameter(
+    "count",
+    app_commands.Range[int, 1, 4],
+    1,
+    description="How many images to generate side by side",
+)
+
+
+@dataclass
+class Endpoint:
+    """A generation command backed by a fal queue endpoint.
+
+    The slash command is generated from `parameters`. Anything specific to
+    the app lives in `module`, which is only imported once the command is
+    first used and may define any of ``build_payload(options)``,
+    ``embed_fields(options)``, ``image_urls(result)``,
+    ``make_view(client, application_id, token, options, issued_at)``,
+    ``on_component(interaction, custom_id)`` (for components whose custom_id
+    starts with ``<name>:``) and the coroutine
+    ``preflight(interaction, options)``, which may raise `InvalidOption`
+    before anything is submitted; simple apps need none of them."""
+
+    name: str
+    description: str
+    url: str
+    title: str
+    parameters: tuple[Parameter, ...]
+    module: str | None = None
+    poll_strategy: PollStrategy = DEFAULT_POLL_STRATEGY
+    # Let identical concurrent commands share a job, and reuse the results
+    # of earlier ones. Only for apps whose output is fully determined by
+    # their options (e.g. with a seed); others are expected to vary.
+    dedupe: bool = False
+    cache: bool = False
+    # Upload result images as attachments instead of hotlinking them.
+    rehost_images: bool = False
+    _hooks: ModuleType | None = field(default=None, init=False, repr=False)
+    _command: app_commands.Command | None = field(default=None, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.url = config.ENDPOINT_URLS.get(self.name, self.url)
+        self.rehost_images = self.rehost_images or self.name in config.REHOST_COMMANDS
+
+    def _hook(self, name: str) -> Callable[..., Any] | None:
+        if self.module is None:
+            return None
+        if self._hooks is None:
+            self._hooks = importlib.import_module(self.module)
+        return getattr(self._hooks, name, None)
+
+    def canonicalize(self, options: dict[str, Any]) -> dict[str, Any]:
+        canonical = dict(options)
+        for parameter in self.parameters:
+            if parameter.name in canonical:
+                canonical[parameter.name] = parameter.canonicalize(
+                    canonical[parameter.name]
+                )
+        return canonical
+
+    async def preflight(
+        self,
+        interaction: discord.Interaction,
+        options: dict[str, Any],
+    ) -> None:
+        if hook := self._hook("preflight"):
+            await hook(interaction, options)
+
+    def build_payload(self, options: dict[str, Any]) -> dict[str, Any]:
+        if hook := self._hook("build_payload"):
+            return hook(options)
+        return dict(options)
+
+    def embed_fields(self, options: dict[str, Any]) -> dict[str, Any]:
+        if hook := self._hook("embed_fields"):
+            return hook(options)
+        return {
+            name.replace("_", " ").title(): value
+            for name, value in options.items()
+            if name != "prompt" and value not in (None, "")
+        }
+
+    def image_urls(self, result: dict[str, Any]) -> list[str]:
+        if hook := self._hook("image_urls"):
+            return hook(result)
+        return [image["url"] for image in result["images"]]
+
+    def make_view(
+        self,
+        client: discord.Client,
+        application_id: int,
+        token: str,
+        options: dict[str, Any],
+        *,
+        issued_at: float | None = None,
+    ) -> discord.ui.View | None:
+        # Takes what is left of the interaction after a restart, so that
+        # resumed requests get their components too.
+        if hook := self._hook("make_view"):
+            return hook(client, application_id, token, options, issued_at=issued_at)
+        return None
+
+    async def handle_component(
+        self,
+        interaction: discord.Interaction,
+        custom_id: str,
+    ) -> None:
+        if hook := self._hook("on_component"):
+            await hook(interaction, custom_id)
+
+    def metric_labels(self, options: dict[str, Any]) -> dict[str, str]:
+        return {
+            "command": self.name,
+            "model": options.get("model_name", self.name),
+            "mode": options.get("mode", ""),
+        }
+
+    def make_embeds(
+        self,
+        results: list[dict[str, Any]],
+        *,
+        options: dict[str, Any],
+        user_mention: str,
+        elapsed: float | None,
+        display_urls: list[str] | None = None,
+    ) -> list[discord.Embed]:
+        fields = self.embed_fields(options)
+        if elapsed is not None:
+            fields["Time Taken"] = f"{elapsed:.2f}s"
+        fields["Generated by"] = user_mention
+
+        image_urls = [self.image_urls(result)[0] for result in results]
+        embed = utils.make_prompted_image_embed(
+            title=self.title,
+            image_url=image_urls[0],
+            prompt=options["prompt"],
+            fields=fields,
+        )
+        return utils.make_gallery_embeds(embed, image_urls, display_urls)
+
+    async def deliver(
+        self,
+        response: discord.Interaction | WebhookResponse,
+        results: list[dict[str, Any]],
+        **kwargs: Any,
+    ) -> None:
+        """Replaces the original response with the results, passing `kwargs`
+        on to `make_embeds` except for the `view`."""
+
+        view = kwargs.pop("view", None)
+        image_delivery: ImageDelivery | None = getattr(
+            response.client, "image_delivery", None
+        )
+        if not self.rehost_images or image_delivery is None:
+            await response.edit_original_response(
+                content=None, embeds=self.make_embeds(results, **kwargs), view=view
+            )
+            return None
+
+        delivery = await image_delivery.prepare(
+            [self.image_urls(result)[0] for result in results]
+        )
+        try:
+            message = await response.edit_original_response(
+                content=None,
+                embeds=self.make_embeds(results, display_urls=delivery.urls, **kwargs),
+                attachments=delivery.files,
+                view=view,
+            )
+        except discord.HTTPException as exc:
+            if exc.status != 413:
+                raise
+            # Over the upload limit of the channel, hotlink after all.
+            await response.edit_original_response(
+                content=None, embeds=self.make_embeds(results, **kwargs), view=view
+            )
+            return None
+        finally:
+            delivery.close()
+        delivery.remember(message)
+
+    async def run(
+        self,
+        interaction: discord.Interaction,
+        options: dict[str, Any],
+    ) -> None:
+        try:
+            options = self.canonicalize(options)
+            await self.preflight(interaction, options)
+        except InvalidOption as exc:
+            # Rejected before taking up a queue slot or a gateway round trip.
+            metrics.JOBS_TOTAL.labels(
+                **self.metric_labels(options), outcome="invalid"
+            ).inc()
+            await interaction.response.send_message(str(exc), ephemeral=True)
+            return None
+
+        count = options.pop("count", 1)
+        await interaction.response.send_message("Your request has been received.")
+
+        task_options = dict(
+            poll_strategy=self.poll_strategy,
+            metric_labels=self.metric_labels(options),
+            **self.build_payload(options),
+        )
+        with utils.Timed() as timer:
+            if count == 1:
+                result = await utils.submit_interactive_task(
+                    interaction,
+                    self.url,
+                    dedupe=self.dedupe,
+                    cache=self.cache,
+                    render_options=options,
+                    **task_options,
+                )
+                results = [] if result is None else [result]
+            else:
+                # Batches are for variations, so neither share nor reuse jobs.
+                results = await utils.submit_interactive_batch(
+                    interaction,
+                    self.url,
+                    count,
+                    render=lambda results: self.make_embeds(
+                        results,
+                        options=options,
+                        user_mention=interaction.user.mention,
+                        elapsed=None,
+                    ),
+                    **task_options,
+                )
+
+        if not results:
+            return None
+
+        await self.deliver(
+            interaction,
+            results,
+            options=options,
+            user_mention=interaction.user.mention,
+            elapsed=timer.elapsed,
+            view=self.make_view(
+                interaction.client,
+                interaction.application_id,
+                interaction.token,
+                {**options, "count": count},
+            ),
+        )
+
+    @property
+    def command(self) -> app_commands.Command:
+        if self._command is None:
+            self._command = self._make_command()
+        return self._command
+
+    def _make_command(self) -> app_commands.Command:
+        parameters = (*self.parameters, COUNT)
+        signature = inspect.Signature(
+            [
+                inspect.Parameter(
+                    "interaction",
+                    inspect.Parameter.POSITIONAL_OR_KEYWORD,
+                    annotation=discord.Interaction,
+                ),
+                *(
+                    inspect.Parameter(
+                        parameter.name,
+                        inspect.Parameter.POSITIONAL_OR_KEYWORD,
+                        annotation=parameter.slash_annotation,
+                        default=parameter.default,
+                    )
+                    for parameter in parameters
+                ),
+            ]
+        )
+
+        async def callback(interaction: discord.Interaction, **options: Any) -> None:
+            arguments = signature.bind(interaction, **options)
+            arguments.apply_defaults()
+            options = dict(arguments.arguments)
+            del options["interaction"]
+            await self.run(interaction, options)
+
+        # discord.py reads the command's options off the callback signature.
+        callback.__signature__ = signature  # type: ignore[attr-defined]
+        app_commands.describe(
+            **{
+                parameter.name: parameter.description
+                for parameter in parameters
+                if parameter.description is not None
+            }
+        )(callback)
+        app_commands.autocomplete(
+            **{
+                parameter.name: parameter.autocomplete
+                or utils.autocomplete_from(parameter.choices or [])
+                for parameter in parameters
+                if parameter.autocomplete is not None or parameter.choices is not None
+            }
+        )(callback)
+
+        return app_commands.Command(
+            name=self.name,
+            description=self.description,
+            callback=callback,  # type: ignore[arg-type]
+            extras={"generation": True},
+        )
+
+
+ENDPOINTS: dict[str, Endpoint] = {}
+
+
+def register(endpoint: Endpoint) -> Endpoint:
+    ENDPOINTS[endpoint.name] = endpoint
+    return endpoint
+
+
+register(
+    Endpoint(
+        name="fooocus",
+        description="Generate an image from the given prompt with the Fooocus model.",
+        url="https://110602490-fooocus.gateway.alpha.fal.ai",
+        title="Fooocus Image",
+        module="fal_bot.fooocus",
+        poll_strategy=AdaptivePolling(min_interval=0.5, max_progress_interval=1.5),
+        parameters=(
+            Parameter("prompt", str),
+            Parameter("style", str, "Fooocus Cinematic", choices=FOOOCUS_STYLES),
+            Parameter("mode", Literal[tuple(FOOOCUS_MODES)], "Speed"),  # type: ignore
+            Parameter("aspect_ratio", str, "1024x1024", choices=FOOOCUS_ASPECT_RATIOS),
+        ),
+    )
+)
+
+register(
+    Endpoint(
+        name="diffusion",
+        description="Run any stable diffusion model with any loras.",
+        url="https://110602490-lora.gateway.alpha.fal.ai",
+        title="Stable Diffusion Image",
+        module="fal_bot.lora",
+        poll_strategy=AdaptivePolling(min_interval=1.0, max_progress_interval=3.0),
+        parameters=(
+            Parameter("prompt", str),
+            Parameter("negative_prompt", str, ""),
+            Parameter("guidance_scale", float, 7.5, minimum=0.0, maximum=20.0),
+            Parameter(
+                "model_name",
+                str,
+                "stabilityai/stable-diffusion-xl-base-1.0",
+                # Any model from the hub works; known ones get canonical names.
+                choices=SD_MODELS,
+                strict=False,
+            ),
+            Parameter("mode", Literal["Speed", "Quality"], "Speed"),
+            Parameter(
+                "scheduler",
+                Literal[tuple(SD_SCHEDULERS)],  # type: ignore
+                "DPM++ 2M Karras",
+            ),
+            Parameter(
+                "lora_url",
+                str | None,
+                None,
+                check=http_url,
+                autocomplete=autocomplete_recent,
+            ),
+            Parameter("lora_scale", float, 1.0, minimum=0.0, maximum=2.0),
+        ),
+    )
+)
@@ -1,21 +1,40 @@
 from __future__ import annotations
 
+import asyncio
+import bisect
+import contextlib
+import functools
 import json
+import logging
+import re
 import time
 from dataclasses import dataclass, field
-from typing import Any, Awaitable, Callable
+from typing import Any, AsyncGenerator, Awaitable, Callable, Coroutine, TypeAlias
 
 import discord
 from discord import app_commands
-from httpx import HTTPStatusError
+from httpx import HTTPError, TransportError
 
-from fal_bot import config
+from fal_bot import config, metrics
+from fal_bot.admission import BATCH, INTERACTIVE, REGENERATE
+from fal_bot.editor import InteractionGone, MessageEditor
+from fal_bot.journal import JournalEntry
 from fal_bot.queue_client import (
+    DEFAULT_POLL_STRATEGY,
+    CircuitOpen,
+    GatewayError,
     InProgress,
+    LogBuffer,
+    PollStrategy,
+    QueueClient,
     Queued,
+    RequestHandle,
+    canonical_key,
     queue_client,
 )
 
+logger = logging.getLogger(__name__)
+
 
 def wrap_source_code(source: str) -> str:
     if len(source) >= 1500:
@@ -26,8 +45,20 @@ def wrap_source_code(source: str) -> str:
 
 def on_error(
     interaction: discord.Interaction,
-) -> Callable[[HTTPStatusError], Awaitable[None]]:
-    async def callback(exception: HTTPStatusError):
+) -> Callable[[GatewayError], Awaitable[None]]:
+    async def callback(exception: GatewayError):
+        if isinstance(exception, CircuitOpen):
+            await interaction.edit_original_response(
+                content="The model is unavailable right now, please try again "
+                f"in {max(exception.retry_in, 1):.0f} seconds."
+            )
+            return
+        if isinstance(exception, TransportError):
+            await interaction.edit_original_response(
+                content="The model could not be reached, please try again later."
+            )
+            return
+
         try:
             data = exception.response.json()
         except json.JSONDecodeError:
@@ -40,80 +71,431 @@ def on_error(
     return callback
 
 
-def format_logs(logs: list[dict[str, Any]], *, max_lines: int = 10) -> str:
-    return "\n".join(
-        [
-            f"{log['message']}"
-            for log in logs[-max_lines * 2 :]
-            if log["message"].strip()
-        ][-max_lines:]
-    )
+async def accept_generation(interaction: discord.Interaction) -> bool:
+    bot = interaction.client
+    if getattr(bot, "draining", False):
+        await interaction.response.send_message(
+            "The bot is restarting, please try again in a minute.",
+            ephemeral=True,
+        )
+        return False
+
+    # Track the task running the command so that draining can wait for it.
+    track = getattr(bot, "track", None)
+    if track is not None and (task := asyncio.current_task()) is not None:
+        name = getattr(interaction.command, "name", "interaction")
+        task.set_name(f"{name} for {interaction.user}")
+        track(task)
+    return True
+
+
+def format_logs(logs: LogBuffer, *, max_lines: int = 10) -> str:
+    return "\n".join(logs.tail(max_lines))
+
+
+@dataclass
+class AutocompleteIndex:
+    # Built once per option list: prefix matches come first, then matches
+    # at the start of a later word, then plain substring matches.
+    options: list[str]
+    limit: int = 25
+    cache_size: int = 512
+
+    def __post_init__(self) -> None:
+        self._keys = [option.lower() for option in self.options]
+        self._prefixes = sorted(
+            (key, position) for position, key in enumerate(self._keys)
+        )
+        self._words = sorted(
+            (key[match.start() :], position)
+            for position, key in enumerate(self._keys)
+            for match in re.finditer(r"\b\w", key)
+            if match.start() > 0
+        )
+        self._cached_choices = functools.lru_cache(maxsize=self.cache_size)(
+            self._choices
+        )
 
+    def choices(self, query: str) -> tuple[app_commands.Choice[str], ...]:
+        return self._cached_choices(query.strip().lower())
 
-def autocomplete_from(
-    options: list[str],
-) -> Callable[[discord.Interaction, str], Awaitable[list[app_commands.Choice[str]]]]:
-    _max_options = 25
+    @staticmethod
+    def _lookup(entries: list[tuple[str, int]], query: str) -> list[int]:
+        start = bisect.bisect_left(entries, (query,))
+        end = bisect.bisect_left(entries, (query + "\uffff",))
+        return sorted({position for _, position in entries[start:end]})
+
+    def _choices(self, query: str) -> tuple[app_commands.Choice[str], ...]:
+        if not query:
+            positions = list(range(min(self.limit, len(self.options))))
+        else:
+            positions = self._lookup(self._prefixes, query)
+            for position in self._lookup(self._words, query):
+                if len(positions) >= self.limit:
+                    break
+                if position not in positions:
+                    positions.append(position)
+            for position, key in enumerate(self._keys):
+                if len(positions) >= self.limit:
+                    break
+                if query in key and position not in positions:
+                    positions.append(position)
+
+        return tuple(
+            app_commands.Choice(
+                name=self.options[position], value=self.options[position]
+            )
+            for position in positions[: self.limit]
+        )
+
+
+Autocomplete: TypeAlias = Callable[
+    [discord.Interaction, str], Coroutine[Any, Any, list[app_commands.Choice[str]]]
+]
+
+
+def autocomplete_from(options: list[str]) -> Autocomplete:
+    # The index is only built once somebody starts typing.
+    @functools.cache
+    def index() -> AutocompleteIndex:
+        return AutocompleteIndex(options)
 
     async def autocomplete(
         interaction: discord.Interaction,
         current: str,
     ):
-        if not current:
-            return [
-                app_commands.Choice(
-                    name=choice,
-                    value=choice,
-                )
-                for choice in options[:_max_options]
-            ]
-        else:
-            return [
-                app_commands.Choice(
-                    name=choice,
-                    value=choice,
-                )
-                for choice in options
-                if current.lower() in choice.lower()
-            ]
+        return list(index().choices(current))
 
     return autocomplete
 
 
-async def submit_interactive_task(
-    interaction: discord.Interaction,
-    url: str,
-    /,
-    **data,
-) -> dict[str, Any]:
-    async with queue_client(
-        url,
-        on_error=on_error(interaction),
-    ) as client:
-        request_handle = await client.submit(data)
-        time_start = time.monotonic()
-
-        iteration_id = 0
-        async for status in client.poll_until_ready(request_handle):
+# Receives a one line status and the formatted recent logs (possibly empty).
+ProgressCallback = Callable[[str, str], None]
+
+
+def show_progress_in(editor: MessageEditor) -> ProgressCallback:
+    def show(status: str, logs: str) -> None:
+        message = status
+        if logs:
+            message += "\n" + wrap_source_code(logs)
+        editor.edit(content=message)
+
+    return show
+
+
+async def report_progress(
+    editor: MessageEditor,
+    statuses: AsyncGenerator[Queued | InProgress, None],
+    request_handle: RequestHandle,
+    *,
+    show: ProgressCallback | None = None,
+    phases: metrics.PhaseTimer | None = None,
+) -> int:
+    if show is None:
+        show = show_progress_in(editor)
+
+    time_start = time.monotonic()
+
+    iteration_id = 0
+    async with contextlib.aclosing(statuses):
+        async for status in statuses:
+            if editor.gone:
+                raise InteractionGone()
+
             match status:
                 case Queued(position):
+                    if phases is not None:
+                        phases.enter("queue")
                     message = "Your request is in queue. "
                     message += f"Position: {position + 1}"
-                    await interaction.edit_original_response(content=message)
-                case InProgress(logs):
+                    show(message, "")
+                case InProgress():
+                    if phases is not None:
+                        phases.enter("progress")
                     message = "Your request is in progress "
                     message += "🏃‍♂️" if iteration_id % 2 == 0 else "🚶"
                     message += f"(running for {time.monotonic() - time_start:.2f}s)"
                     message += "."
-                    if formatted_logs := format_logs(logs):
-                        message += "\n" + wrap_source_code(formatted_logs)
-
-                    await interaction.edit_original_response(content=message)
+                    show(message, format_logs(request_handle.logs))
 
             iteration_id += 1
+    return iteration_id
+
+
+def watch_status(
+    bot: discord.Client,
+    client: QueueClient,
+    request_handle: RequestHandle,
+    *,
+    poll_strategy: PollStrategy = DEFAULT_POLL_STRATEGY,
+) -> AsyncGenerator[Queued | InProgress, None]:
+    # The poller follows each request once, streaming or polling it, however
+    # many callers are waiting on it.
+    poller = getattr(bot, "status_poller", None)
+    if poller is not None:
+        return poller.watch(client, request_handle, strategy=poll_strategy)
+
+    def poll() -> AsyncGenerator[Queued | InProgress, None]:
+        return client.poll_until_ready(request_handle, strategy=poll_strategy)
+
+    if config.STATUS_STREAMING:
+        return client.stream_until_ready(request_handle, fallback=poll)
+    return poll()
+
+
+async def abandon(client: QueueClient, request_handle: RequestHandle) -> None:
+    try:
+        await client.cancel(request_handle)
+    except HTTPError:
+        logger.warning("Failed to cancel request %s", request_handle.request_id)
+    else:
+        logger.info("Cancelled abandoned request %s", request_handle.request_id)
+
+
+async def submit_interactive_task(
+    interaction: discord.Interaction,
+    url: str,
+    /,
+    *,
+    poll_strategy: PollStrategy = DEFAULT_POLL_STRATEGY,
+    dedupe: bool = False,
+    cache: bool = False,
+    metric_labels: dict[str, str] | None = None,
+    render_options: dict[str, Any] | None = None,
+    editor: MessageEditor | None = None,
+    show_progress: ProgressCallback | None = None,
+    on_failure: Callable[[GatewayError], Awaitable[None]] | None = None,
+    lane: str | None = None,
+    **data,
+) -> dict[str, Any] | None:
+    # Callers that pass their own editor (e.g. batches sharing a message)
+    # are responsible for flushing it.
+    owns_editor = editor is None
+    if editor is None:
+        editor = MessageEditor(interaction)
+    if show_progress is None:
+        show_progress = show_progress_in(editor)
+
+    bot = interaction.client
+    single_flight = getattr(bot, "single_flight", None) if dedupe else None
+    result_cache = getattr(bot, "result_cache", None) if cache else None
+    labels = {"command": "", "model": "", "mode": "", **(metric_labels or {})}
+
+    # Only requests that know how to render their result can be resumed
+    # after a restart.
+    journal = getattr(bot, "journal", None) if render_options is not None else None
+
+    key = canonical_key(url, data)
+    if result_cache is not None:
+        if (result := await result_cache.get(key)) is not None:
+            metrics.JOBS_TOTAL.labels(**labels, outcome="cached").inc()
+            return result
+
+    if lane is None:
+        # Re-rolls come in through the buttons of an earlier result.
+        if interaction.type is discord.InteractionType.component:
+            lane = REGENERATE
+        else:
+            lane = INTERACTIVE
+
+    admission = getattr(bot, "admission", None)
+    if admission is not None:
+        admitted = admission.admit(
+            url,
+            interaction.user.id,
+            lane=lane,
+            on_wait=lambda position: show_progress(
+                f"Your request is waiting for a free slot. Position: {position}", ""
+            ),
+        )
+    else:
+        admitted = contextlib.nullcontext()
+
+    in_flight = metrics.JOBS_IN_FLIGHT.labels(command=labels["command"])
+    in_flight.inc()
+    phases = metrics.PhaseTimer(labels)
+    phases.enter("admission")
+    outcome = "failed"
+    journaled = False
+    # Whether this caller still counts as waiting on a shared job; it has
+    # to leave it however it exits, or later callers attach to a dead job.
+    attached = False
+    try:
+        async with queue_client(
+            url,
+            pool=getattr(bot, "http_clients", None),
+            on_error=on_failure or on_error(interaction),
+        ) as client:
+            # Fail fast instead of queueing up for a gateway that is down.
+            client.ensure_available()
+            async with admitted:
+                # Progress edits are coalesced; flushing before leaving makes sure
+                # none of them can land on top of the error or final edit.
+                try:
+                    phases.enter("submit")
+                    if single_flight is not None:
+                        request_handle = await single_flight.submit(client, key, data)
+                        attached = True
+                    else:
+                        request_handle = await client.submit(data)
+
+                    if journal is not None:
+                        journal.submitted(
+                            JournalEntry(
+                                token=interaction.token,
+                                application_id=interaction.application_id,
+                                request_id=request_handle.request_id,
+                                url=(request_handle.via or client).url,
+                                command=labels["command"],
+                                options=render_options,  # type: ignore[arg-type]
+                                user_mention=interaction.user.mention,
+                            )
+                        )
+                        journaled = True
+
+                    statuses = watch_status(
+                        bot, client, request_handle, poll_strategy=poll_strategy
+                    )
+                    polls = await report_progress(
+                        editor,
+                        statuses,
+                        request_handle,
+                        show=show_progress,
+                        phases=phases,
+                    )
+                except InteractionGone:
+                    # Nobody is going to see the result, so stop paying for it
+                    # unless someone else is waiting on the same job.
+                    attached = False
+                    if single_flight is None or single_flight.leave(
+                        key, request_handle
+                    ):
+                        await abandon(client, request_handle)
+                    outcome = "abandoned"
+                    return None
+                finally:
+                    if owns_editor:
+                        await editor.flush()
+
+                phases.enter("result")
+                if single_flight is not None:
+                    # The flight is forgotten once its result is in.
+                    attached = False
+                    result = await single_flight.result(client, key, request_handle)
+                else:
+                    result = await client.result(request_handle)
+
+                if result_cache is not None:
+                    await result_cache.set(key, result)
+
+                metrics.JOB_STATUS_POLLS.labels(**labels).observe(polls)
+                outcome = "completed"
+                return result
+    except asyncio.CancelledError:
+        # Leave the journal entry in place; the request is resumed on the
+        # next start.
+        journaled = False
+        raise
+    finally:
+        if attached:
+            single_flight.leave(key, request_handle)  # type: ignore[union-attr]
+        if journaled:
+            journal.finished(interaction.token)  # type: ignore[union-attr]
+
+        phases.enter(None)
+        in_flight.dec()
+        metrics.JOBS_TOTAL.labels(**labels, outcome=outcome).inc()
+
+
+async def submit_interactive_batch(
+    interaction: discord.Interaction,
+    url: str,
+    count: int,
+    /,
+    *,
+    render: Callable[[list[dict[str, Any]]], list[discord.Embed]],
+    **kwargs: Any,
+) -> list[dict[str, Any]]:
+    # Runs `count` jobs side by side behind a single message: one status
+    # line per job, and a gallery of the results that arrived so far.
+    editor = MessageEditor(interaction)
+    lines = ["Your request has been received."] * count
+    results: list[dict[str, Any] | None] = [None] * count
+
+    def refresh() -> None:
+        content = "\n".join(
+            f"**Image {index + 1}:** {line}" for index, line in enumerate(lines)
+        )
+        done = [result for result in results if result is not None]
+        editor.edit(content=content, embeds=render(done) if done else [])
+
+    def show_progress(index: int) -> ProgressCallback:
+        def show(status: str, logs: str) -> None:
+            lines[index] = status
+            refresh()
+
+        return show
+
+    def on_failure(index: int) -> Callable[[GatewayError], Awaitable[None]]:
+        async def callback(exception: GatewayError) -> None:
+            if isinstance(exception, CircuitOpen):
+                lines[index] = "The model is unavailable right now."
+            elif isinstance(exception, TransportError):
+                lines[index] = "The model could not be reached."
+            else:
+                lines[index] = f"Failed ({exception.response.status_code})."
+            refresh()
+
+        return callback
+
+    async def run(index: int) -> None:
+        # A failed job must not take the others down with it: they would go
+        # on editing the message after the command is over.
+        try:
+            result = await submit_interactive_task(
+                interaction,
+                url,
+                editor=editor,
+                show_progress=show_progress(index),
+                on_failure=on_failure(index),
+                lane=BATCH,
+                **kwargs,
+            )
+        except Exception:
+            logger.exception("Image %d of a batch failed", index + 1)
+            lines[index] = "Failed."
+            refresh()
+            return
+
+        if result is not None:
+            results[index] = result
+            lines[index] = "Done."
+            refresh()
+
+    try:
+        await asyncio.gather(*(run(index) for index in range(count)))
+    finally:
+        await editor.flush()
+
+    return [result for result in results if result is not None]
+
+
+def make_gallery_embeds(
+    embed: discord.Embed,
+    image_urls: list[str],
+    display_urls: list[str] | None = None,
+) -> list[discord.Embed]:
+    # Discord groups up to four embeds sharing the same URL into a single
+    # image gallery. The images shown may be copies of the ones at
+    # `image_urls`, e.g. attachments.
+    display_urls = display_urls or image_urls
+    embed.url = image_urls[0]
+    embed.set_image(url=display_urls[0])
 
-        result = await client.result(request_handle)
-        return result
+    embeds = [embed]
+    for display_url in display_urls[1:4]:
+        embeds.append(discord.Embed(url=embed.url).set_image(url=display_url))
+    return embeds
 
 
 def make_prompted_image_embed(
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import json
+import secrets
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any
+
+from fal_bot import config
+
+
+class ViewState:
+    # One of these is kept per result message with buttons, so it is
+    # deliberately small: no interaction, no dicts.
+    __slots__ = ("application_id", "token", "created_at", "packed_options")
+
+    def __init__(
+        self,
+        application_id: int,
+        token: str,
+        options: dict[str, Any],
+        created_at: float | None = None,
+    ) -> None:
+        self.application_id = application_id
+        self.token = token
+        # When the token was issued, which may be well before a resumed
+        # request's result arrives.
+        self.created_at = time.time() if created_at is None else created_at
+        self.packed_options = json.dumps(options, separators=(",", ":")).encode()
+
+    @property
+    def options(self) -> dict[str, Any]:
+        return json.loads(self.packed_options)
+
+
+@dataclass
+class ViewStateStore:
+    """What persistent component handlers need to know about the message
+    they are attached to, keyed by a short id embedded in the custom_id.
+
+    Each entry is used at most once, as the components are removed when
+    clicked, and the oldest entries are evicted first; handlers are expected
+    to reconstruct what they need from the custom_id and message otherwise."""
+
+    max_entries: int = config.VIEW_STATE_SIZE
+    ttl: float = config.VIEW_STATE_TTL
+    _entries: OrderedDict[str, ViewState] = field(
+        default_factory=OrderedDict, init=False, repr=False
+    )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, state: ViewState) -> str:
+        key = secrets.token_hex(4)
+        self._entries[key] = state
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return key
+
+    def pop(self, key: str) -> ViewState | None:
+        state = self._entries.pop(key, None)
+        if state is None or state.created_at + self.ttl <= time.time():
+            return None
+        return state